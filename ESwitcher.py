@@ -1,5 +1,9 @@
+import bisect
+import collections
 import math
 import os
+import sys
+import time
 
 import maya.OpenMayaUI as omui
 import maya.cmds as cmds
@@ -11,10 +15,19 @@ from shiboken2 import wrapInstance
 import maya.OpenMaya as OpenMaya
 import re
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def maya_main_window():
     main_window_ptr = omui.MQtUtil.mainWindow()
     return wrapInstance(int(main_window_ptr), QtWidgets.QWidget)
 
+if 'lifecycle' in globals():
+    # Reloading the module must not leave the previous instance's scriptJobs and widgets behind.
+    lifecycle.teardown()
+
 windows = {
     'left': None,
     'right': None,
@@ -27,12 +40,108 @@ windows = {
     'settingssmall' : None
 }
 
+def cache_size(obj, seen=None):
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(cache_size(key, seen) + cache_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(cache_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += cache_size(vars(obj), seen)
+    return size
+
+class Lifecycle:
+    # Owns everything the tool leaves behind between hotkey presses: the popups in `windows`, their
+    # timers, scriptJobs and any caches. All of it is released when the popup closes, when a scene
+    # is opened or created, and on teardown before the module is reloaded.
+    scene_events = ('SceneOpened', 'NewSceneOpened')
+
+    def __init__(self):
+        self.timers = []
+        self.script_jobs = []
+        self.caches = {}
+
+    def install(self):
+        if self.script_jobs:
+            return
+        for event in self.scene_events:
+            self.script_jobs.append(cmds.scriptJob(event=[event, self.release]))
+
+    def track_timer(self, timer):
+        self.timers.append(timer)
+        return timer
+
+    def register_cache(self, name, cache):
+        # Caches are also used from scripts that never open the popup, so they bring the scene jobs along.
+        self.install()
+        self.caches[name] = cache
+        return cache
+
+    def is_live(self, window):
+        return window is not None and any(window is live for live in windows.values())
+
+    def close_windows(self):
+        for name, window in windows.items():
+            if window is None:
+                continue
+            windows[name] = None
+            try:
+                window.close()
+                window.deleteLater()
+            except RuntimeError:
+                # The Qt side is already gone, e.g. Maya closed it with its parent.
+                pass
+        self.stop_timers()
+
+    def stop_timers(self):
+        for timer in self.timers:
+            try:
+                timer.stop()
+            except RuntimeError:
+                pass
+        self.timers = []
+
+    def clear_caches(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    def release(self):
+        self.close_windows()
+        self.clear_caches()
+
+    def teardown(self):
+        self.release()
+        for job in self.script_jobs:
+            if cmds.scriptJob(exists=job):
+                cmds.scriptJob(kill=job, force=True)
+        self.script_jobs = []
+
+    def diagnostics(self):
+        live_timers = 0
+        for timer in self.timers:
+            try:
+                live_timers += bool(timer.isActive())
+            except RuntimeError:
+                pass
+        return {
+            'windows': [name for name, window in windows.items() if window is not None],
+            'timers': live_timers,
+            'script_jobs': len(self.script_jobs),
+            'caches': dict((name, cache_size(cache)) for name, cache in self.caches.items()),
+        }
+
+lifecycle = Lifecycle()
+
 class CircleWidget(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super(CircleWidget, self).__init__(parent)
         self.line_to_cursor = None
         self.setMouseTracking(True)
-        self.timer = QtCore.QTimer()
+        self.timer = lifecycle.track_timer(QtCore.QTimer(self))
         self.timer.timeout.connect(self.update_line_to_cursor)
         self.timer.start(10)
 
@@ -69,6 +178,12 @@ class CircleWidget(QtWidgets.QWidget):
             painter.setPen(pen)
             painter.drawLine(self.line_to_cursor)
 
+    def hideEvent(self, event):
+        self.timer.stop()
+
+    def showEvent(self, event):
+        self.timer.start(10)
+
     def closeEvent(self, event):
         self.timer.stop()
 
@@ -98,15 +213,6 @@ class MiddlePoint(QtWidgets.QDialog):
         self.show()
 
 class BasePopupWindow(QtWidgets.QDialog):
-    attribute_to_optionvar = {
-        'Follow': 'ESwitch_Follow',
-        'Global': 'ESwitch_Global',
-        'GlobalTranslate': 'ESwitch_GlobalTranslate',
-        'Lock': 'ESwitch_Lock',
-    }
-
-
-
     def __init__(self, parent=maya_main_window(), icon_name="", attribute_name=""):
         super(BasePopupWindow, self).__init__(parent)     
         
@@ -139,19 +245,9 @@ class BasePopupWindow(QtWidgets.QDialog):
 
     def enterEvent(self, event):
         print(self.attribute_name)
-        try:
-            for window_name in ['left', 'bottom', 'right', 'middle', 'topleft', 'topright', 'middletopleft', 'middletopright', 'settingssmall']:
-                if windows[window_name] is not None:
-                    windows[window_name].close()
-                    windows[window_name] = None
-        except:
-            pass
-        
-        optionvar_key = self.attribute_to_optionvar.get(self.attribute_name, self.attribute_name)
-        
-        attribute_name = cmds.optionVar(q=optionvar_key) or self.attribute_name
+        lifecycle.close_windows()
         
-        attribute_instance = AttributeSwitch(attribute_name)
+        attribute_instance = Switch(self.attribute_name, mirror=bool(cmds.optionVar(q="ESwitch_Mirror")))
         
         event.accept()   
 
@@ -206,6 +302,13 @@ class WorldSnapPopupWindow(BasePopupWindow):
                 min-height: 40;
             }
         """)
+
+    def enterEvent(self, event):
+        lifecycle.close_windows()
+
+        snap_instance = WorldSnap()
+
+        event.accept()
         
 class SettingsSmallPopupWindow(BasePopupWindow):
     def __init__(self, parent=maya_main_window()):
@@ -254,13 +357,7 @@ class ObjSnapPopupWindow(BasePopupWindow):
         """)
 
     def enterEvent(self, event):
-        try:
-            for window_name in ['left', 'bottom', 'right', 'middle', 'topleft', 'topright', 'middletopleft', 'middletopright', 'settingssmall']:
-                if windows[window_name] is not None:
-                    windows[window_name].close()
-                    windows[window_name] = None
-        except:
-            pass
+        lifecycle.close_windows()
 
         attribute_instance = ObjSnap()
 
@@ -305,16 +402,9 @@ class LockPopupWindow(QtWidgets.QDialog):
     def enterEvent(self, event):
         if isinstance(self, LockPopupWindow):        
             print("Lock")
-            try:
-                for window_name in ['left', 'bottom', 'right', 'middle', 'topleft', 'topright', 'middletopleft', 'middletopright', 'settingssmall']:
-                    if windows[window_name] is not None:
-                        windows[window_name].close()
-                        windows[window_name] = None
-            except:
-                pass
+            lifecycle.close_windows()
             
-            lock_attr_name = cmds.optionVar(q="ESwitch_Lock") or 'Lock'
-            lock_instance = Lock(lock_attr_name)
+            lock_instance = Switch('Lock', mirror=bool(cmds.optionVar(q="ESwitch_Mirror")))
         event.accept()
 
 
@@ -324,7 +414,7 @@ class SettingsPopupWindow(QtWidgets.QDialog):
         super(SettingsPopupWindow, self).__init__(parent)
         self.close_in_progress = False 
         
-        self.setFixedSize(210, 300)
+        self.setFixedSize(210, 325)
 
         if position is not None:
             self.move(position)
@@ -343,7 +433,7 @@ class SettingsPopupWindow(QtWidgets.QDialog):
                 background-color: rgba(10, 10, 10, 240);
                 border-radius: 10px;
                 min-width: 210;
-                min-height: 300;                
+                min-height: 325;                
             }
         """)
 
@@ -457,6 +547,9 @@ class SettingsPopupWindow(QtWidgets.QDialog):
         self.bone_names_layout.addWidget(self.elbow_name_field)         
         self.bone_names_layout.addWidget(self.knee_name_field)     
 
+        self.mirror_checkbox = QtWidgets.QCheckBox("Switch mirrored L/R pairs", self)
+        self.mirror_checkbox.setStyleSheet("font-size: 13px;")
+
         self.main_layout.addWidget(self.follow_attribute_label)
         self.main_layout.addWidget(self.follow_attribute_field)
         self.main_layout.addWidget(self.global_attribute_label)
@@ -467,6 +560,7 @@ class SettingsPopupWindow(QtWidgets.QDialog):
         self.main_layout.addWidget(self.lock_attribute_field)      
         self.main_layout.addWidget(self.elbow_name_label)
         self.main_layout.addLayout(self.bone_names_layout)    
+        self.main_layout.addWidget(self.mirror_checkbox)
         
         follow_attribute_value = cmds.optionVar(q="ESwitch_Follow")
         global_attribute_value = cmds.optionVar(q="ESwitch_Global")
@@ -480,6 +574,7 @@ class SettingsPopupWindow(QtWidgets.QDialog):
         self.lock_attribute_field.setText(lock_attribute_value or 'Lock')
         self.elbow_name_field.setText(elbow_name_value or 'Elbow')
         self.knee_name_field.setText(knee_name_value or 'Knee')
+        self.mirror_checkbox.setChecked(bool(cmds.optionVar(q="ESwitch_Mirror")))
 
         self.show()
         
@@ -494,7 +589,9 @@ class SettingsPopupWindow(QtWidgets.QDialog):
     def close_and_show_small_popup_window(self):
         self.close_in_progress = True
         self.close()
-        self.parent().show()
+        # The small settings button may have been released in the meantime and must not come back.
+        if lifecycle.is_live(self.parent()):
+            self.parent().show()
         self.close_in_progress = False
 
     def about(self):
@@ -509,13 +606,7 @@ class SettingsPopupWindow(QtWidgets.QDialog):
         if not self.close_in_progress:
             if isinstance(self, SettingsPopupWindow):
                 self.close()
-                try:
-                    for window_name in ['left', 'bottom', 'right', 'middle', 'topleft', 'topright', 'middletopleft', 'middletopright', 'settingssmall']:
-                        if windows[window_name] is not None:
-                            windows[window_name].close()
-                            windows[window_name] = None
-                except:
-                    pass
+                lifecycle.close_windows()
 
 
 
@@ -528,6 +619,8 @@ class SettingsPopupWindow(QtWidgets.QDialog):
             cmds.optionVar(sv=("ESwitch_Lock", self.lock_attribute_field.text()))        
             cmds.optionVar(sv=("ESwitch_Elbow", self.elbow_name_field.text()))                
             cmds.optionVar(sv=("ESwitch_Knee", self.knee_name_field.text()))   
+            cmds.optionVar(iv=("ESwitch_Mirror", int(self.mirror_checkbox.isChecked())))
+            plans.clear()
 
         super(SettingsPopupWindow, self).closeEvent(event)
 
@@ -564,196 +657,723 @@ class AboutDialog(QtWidgets.QDialog):
         if frame_number == movie.frameCount() - 1:
             movie.setPaused(True)
 
-class AttributeSwitch:
-    def __init__(self, attr_name):
-        self.attr_name = attr_name
-        
-        self.selected_objects = cmds.ls(selection=True)
-
-        self.time_slider_selection = cmds.timeControl("timeControl1", q=True, rangeArray=True)
-
-        self.current_selection = cmds.ls(selection=True)
-
-        self.current_tool = cmds.currentCtx()
-
-        cmds.undoInfo(openChunk=True)
-
-        cmds.setToolTo('moveSuperContext')
-
-        if not self.selected_objects:
-            cmds.inViewMessage(amg="No objects selected. Please select objects.", pos="topCenter", fade=True)
+ROTATE_ORDERS = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')
+
+TRANSFORM_CHANNELS = ('translateX', 'translateY', 'translateZ',
+                      'rotateX', 'rotateY', 'rotateZ',
+                      'scaleX', 'scaleY', 'scaleZ')
+
+GIMBAL_LIMIT = 1.0 - 1e-12
+
+def multiply_matrix(a, b):
+    return [sum(a[row * 4 + k] * b[k * 4 + col] for k in range(4)) for row in range(4) for col in range(4)]
+
+def multiply_matrices(a, b):
+    if numpy is None:
+        return [multiply_matrix(x, y) for x, y in zip(a, b)]
+    a = numpy.asarray(a, dtype=float).reshape(-1, 4, 4)
+    b = numpy.asarray(b, dtype=float).reshape(-1, 4, 4)
+    return numpy.matmul(a, b).reshape(-1, 16)
+
+def euler_axes(rotate_order):
+    order = ROTATE_ORDERS[rotate_order]
+    i, j, k = ['xyz'.index(axis) for axis in order]
+    parity = 1.0 if order in ('xyz', 'yzx', 'zxy') else -1.0
+    return i, j, k, parity
+
+def decompose_matrix(matrix, rotate_order=0):
+    rows = [list(matrix[0:3]), list(matrix[4:7]), list(matrix[8:11])]
+    scale = [math.sqrt(sum(v * v for v in row)) or 1.0 for row in rows]
+    determinant = (rows[0][0] * (rows[1][1] * rows[2][2] - rows[1][2] * rows[2][1])
+                   - rows[0][1] * (rows[1][0] * rows[2][2] - rows[1][2] * rows[2][0])
+                   + rows[0][2] * (rows[1][0] * rows[2][1] - rows[1][1] * rows[2][0]))
+    if determinant < 0.0:
+        scale[0] = -scale[0]
+    rows = [[v / scale[n] for v in row] for n, row in enumerate(rows)]
+
+    i, j, k, parity = euler_axes(rotate_order)
+    rotate = [0.0, 0.0, 0.0]
+    sin_middle = max(-1.0, min(1.0, -parity * rows[i][k]))
+    rotate[j] = math.asin(sin_middle)
+    if abs(sin_middle) < GIMBAL_LIMIT:
+        rotate[i] = math.atan2(parity * rows[j][k], rows[k][k])
+        rotate[k] = math.atan2(parity * rows[i][j], rows[i][i])
+    else:
+        rotate[i] = math.atan2(-parity * rows[k][j], rows[j][j])
+
+    return list(matrix[12:15]), [math.degrees(angle) for angle in rotate], scale
+
+def decompose_matrices(matrices, rotate_order=0):
+    if numpy is None:
+        decomposed = [decompose_matrix(matrix, rotate_order) for matrix in matrices]
+        return [d[0] for d in decomposed], [d[1] for d in decomposed], [d[2] for d in decomposed]
+
+    m = numpy.asarray(matrices, dtype=float).reshape(-1, 4, 4)
+    rows = m[:, :3, :3]
+    scale = numpy.linalg.norm(rows, axis=2)
+    scale[scale == 0.0] = 1.0
+    scale[numpy.linalg.det(rows) < 0.0, 0] *= -1.0
+    rows = rows / scale[:, :, None]
+
+    i, j, k, parity = euler_axes(rotate_order)
+    sin_middle = numpy.clip(-parity * rows[:, i, k], -1.0, 1.0)
+    locked = numpy.abs(sin_middle) >= GIMBAL_LIMIT
+    rotate = numpy.zeros((len(m), 3))
+    rotate[:, j] = numpy.arcsin(sin_middle)
+    rotate[:, i] = numpy.where(locked,
+                               numpy.arctan2(-parity * rows[:, k, j], rows[:, j, j]),
+                               numpy.arctan2(parity * rows[:, j, k], rows[:, k, k]))
+    rotate[:, k] = numpy.where(locked, 0.0, numpy.arctan2(parity * rows[:, i, j], rows[:, i, i]))
+
+    return m[:, 3, :3].tolist(), numpy.degrees(rotate).tolist(), scale.tolist()
+
+def alternate_euler(rotate, rotate_order):
+    i, j, k, _ = euler_axes(rotate_order)
+    alternate = list(rotate)
+    alternate[i] += 180.0
+    alternate[j] = 180.0 - alternate[j]
+    alternate[k] += 180.0
+    return alternate
+
+def wrap_angle(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+def filter_euler(rotates, rotate_order=0, seed=None):
+    # Every rotation has two Euler solutions, each repeating every 360 degrees. Per frame this picks
+    # the one closest to the previous frame, like Maya's Euler filter but before the keys exist.
+    if not rotates:
+        return rotates
+
+    if numpy is None:
+        previous = seed or rotates[0]
+        filtered = []
+        for rotate in rotates:
+            best = None
+            for candidate in (rotate, alternate_euler(rotate, rotate_order)):
+                candidate = [last - wrap_angle(last - value) for value, last in zip(candidate, previous)]
+                distance = sum(abs(value - last) for value, last in zip(candidate, previous))
+                if best is None or distance < best[0]:
+                    best = (distance, candidate)
+            previous = best[1]
+            filtered.append(previous)
+        return filtered
+
+    i, j, k, _ = euler_axes(rotate_order)
+    raw = numpy.asarray([seed or rotates[0]] + list(rotates), dtype=float)
+    alternate = raw.copy()
+    alternate[:, i] += 180.0
+    alternate[:, j] = 180.0 - alternate[:, j]
+    alternate[:, k] += 180.0
+
+    # Wrapped distances do not change when both frames switch solution, so whether a frame changes
+    # solution relative to its predecessor is known up front and the choice is a running parity.
+    same = numpy.abs(wrap_angle(numpy.diff(raw, axis=0))).sum(axis=1)
+    crossed = numpy.abs(wrap_angle(alternate[1:] - raw[:-1])).sum(axis=1)
+    switched = numpy.concatenate(([False], numpy.cumsum(crossed < same) % 2 == 1))
+    chosen = numpy.where(switched[:, None], alternate, raw)
+
+    unwrapped = chosen[0] + numpy.cumsum(numpy.concatenate((numpy.zeros((1, 3)), wrap_angle(numpy.diff(chosen, axis=0)))), axis=0)
+    return unwrapped[1:].tolist()
+
+def solve_transforms(samples):
+    # Entries sharing a rotate order are stacked so each order is solved in one vectorized call.
+    by_order = collections.OrderedDict()
+    for node, rotate_order, frames, targets, parent_inverses in samples:
+        by_order.setdefault(rotate_order, []).append((node, frames, targets, parent_inverses))
+
+    solved = []
+    for rotate_order, entries in by_order.items():
+        targets = [matrix for entry in entries for matrix in entry[2]]
+        parent_inverses = [matrix for entry in entries for matrix in entry[3]]
+        translates, rotates, scales = decompose_matrices(multiply_matrices(targets, parent_inverses), rotate_order)
+        start = 0
+        for node, frames, _, _ in entries:
+            end = start + len(frames)
+            solved.append((node, frames, translates[start:end], rotates[start:end], scales[start:end]))
+            start = end
+    return solved
+
+def resolve_frame_ranges(ranges=None, frames=None):
+    # Ranges are inclusive (start, end) pairs and explicit frames become single-frame ranges,
+    # all merged into one sorted set so a single pass covers every requested frame.
+    if ranges is None and frames is None:
+        time_slider_selection = cmds.timeControl("timeControl1", q=True, rangeArray=True)
+        ranges = [time_slider_selection] if time_slider_selection else []
+
+    spans = sorted([(float(start), float(end)) for start, end in ranges or []] + [(float(frame), float(frame)) for frame in frames or []])
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
         else:
-            for obj in self.selected_objects:
-                self.process_object(obj)
-
-        cmds.setToolTo(self.current_tool)
-        
-        if self.current_selection:
-            cmds.select(self.current_selection)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def process_object(self, obj):
-        attrs = cmds.listAttr(obj)
-
-        if not attrs:
-            return 
-        
-        if self.attr_name not in attrs:
-            cmds.inViewMessage(amg="No '{}' attribute found for {}. Locator not created.".format(self.attr_name, obj), pos="topCenter", fade=True)
-            return
-
-        attr_name_orig = self.attr_name
-
-        if self.time_slider_selection:
-            keyframes = cmds.keyframe(obj, attribute=attr_name_orig, query=True, time=(self.time_slider_selection[0], self.time_slider_selection[1]))
-            if keyframes:
-                for keyframe in keyframes:
-                    cmds.currentTime(keyframe)
-                    self.process_keyframe(obj, attr_name_orig, keyframes=True)
-            else:
-                self.process_keyframe(obj, attr_name_orig, keyframes=False)
-
-    def process_keyframe(self, obj, attr_name, keyframes=False):
-        loc = cmds.spaceLocator(name="Locator#{}".format(obj))
-
-        cmds.matchTransform(loc[0], obj, pos=True, rot=True, scl=True)
-
-        attr_value = cmds.getAttr("{}.{}".format(obj, attr_name))
-        attr_min_value = cmds.addAttr("{}.{}".format(obj, attr_name), q=True, min=True)
-        attr_max_value = cmds.addAttr("{}.{}".format(obj, attr_name), q=True, max=True)
-        mid_point = attr_min_value + ((attr_max_value - attr_min_value) / 2)
-
-        if attr_value >= mid_point:
-            cmds.setAttr("{}.{}".format(obj, attr_name), attr_min_value)
-        else:
-            cmds.setAttr("{}.{}".format(obj, attr_name), attr_max_value)
-
-        if keyframes or cmds.keyframe(obj, attribute=attr_name, query=True):
-            cmds.setKeyframe(obj, attribute=attr_name)
-
-        cmds.matchTransform(obj, loc[0], pos=True, rot=True, scl=True)
-
-        cmds.delete(loc[0])
-
-        cmds.inViewMessage(amg="'{}' attribute switched for {}.".format(attr_name, obj), pos="topCenter", fade=True)
-
-class Lock:
-    def __init__(self, lock_attr_name):
-        self.selected_objects = cmds.ls(selection=True)
-
-        cmds.undoInfo(openChunk=True)
-
-        if not self.selected_objects:
-            cmds.inViewMessage(amg="No objects selected. Please select objects.", pos="topCenter", fade=True)
-            return
-
-        self.current_selection = cmds.ls(selection=True)
-
-        self.current_tool = cmds.currentCtx()
-        cmds.setToolTo('moveSuperContext')
-
-        self.time_slider_selection = cmds.timeControl("timeControl1", q=True, rangeArray=True)
-
-        for controller in self.selected_objects:
-            self.process_controller(controller, lock_attr_name)
-
-        cmds.setToolTo(self.current_tool)
-
-        if self.current_selection:
-            cmds.select(self.current_selection)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def process_controller(self, controller, lock_attr_name):
-        attrs = [attr.lower() for attr in cmds.listAttr(controller)]
-        
-        if lock_attr_name.lower() in attrs:
-            lock_attr_name_orig = cmds.listAttr(controller)[attrs.index(lock_attr_name.lower())]
-
-            joint = self.identify_joint(controller)
-
-            if joint:
-                if self.time_slider_selection:
-                    keyframes = cmds.keyframe(controller, attribute=lock_attr_name_orig, query=True, time=(self.time_slider_selection[0], self.time_slider_selection[1]))
-                    if keyframes:
-                        for keyframe in keyframes:
-                            cmds.currentTime(keyframe)
-                            self.process_keyframe(controller, joint, lock_attr_name_orig, keyframes=True)
-                    else:
-                        self.process_keyframe(controller, joint, lock_attr_name_orig, keyframes=False)
-                else:
-                    self.process_keyframe(controller, joint, lock_attr_name_orig, keyframes=False)
-            else:
-                cmds.inViewMessage(amg="No joint identified for {}. Locator not created.".format(controller), pos="topCenter", fade=True)
-
+            merged.append((start, end))
+    return merged
+
+def frames_in_ranges(ranges):
+    frames = set()
+    for start, end in ranges:
+        if start == end:
+            frames.add(start)
         else:
-            cmds.inViewMessage(amg="No '{}' attribute found for {}. Locator not created.".format(lock_attr_name, controller), pos="topCenter", fade=True)
-
-
-        cmds.setToolTo(self.current_tool)
-
-        if self.current_selection:
-            cmds.select(self.current_selection)
-
-    def process_keyframe(self, controller, joint, lock_attr_name, keyframes=False):
-        loc = cmds.spaceLocator(name="Locator#{}".format(controller))
-        cmds.matchTransform(loc[0], joint, pos=True, rot=True, scl=True)
-
-        lock_value = cmds.getAttr("{}.{}".format(controller, lock_attr_name))
-        lock_min_value = cmds.addAttr("{}.{}".format(controller, lock_attr_name), q=True, min=True)
-        lock_max_value = cmds.addAttr("{}.{}".format(controller, lock_attr_name), q=True, max=True)
-        mid_point = lock_min_value + ((lock_max_value - lock_min_value) / 2)
-
-        if lock_value >= mid_point:
-            cmds.setAttr("{}.{}".format(controller, lock_attr_name), lock_min_value)
-        else:
-            cmds.setAttr("{}.{}".format(controller, lock_attr_name), lock_max_value)
-
-        if keyframes or cmds.keyframe(controller, attribute=lock_attr_name, query=True):
-            cmds.setKeyframe(controller, attribute=lock_attr_name)
+            frames.update(float(frame) for frame in range(int(start), int(end) + 1))
+    return sorted(frames)
+
+def keys_in_ranges(node, attr_name, ranges):
+    if not ranges:
+        return []
+    keyframes = cmds.keyframe(node, attribute=attr_name, query=True, time=(ranges[0][0], ranges[-1][1])) or []
+    return [keyframe for keyframe in keyframes if any(start <= keyframe <= end for start, end in ranges)]
+
+def shot_ranges(shots=None):
+    shots = shots or cmds.ls(type='shot') or []
+    return [(cmds.shot(shot, q=True, startTime=True), cmds.shot(shot, q=True, endTime=True)) for shot in shots]
+
+def supports_batch(node):
+    if cmds.nodeType(node) != 'transform':
+        return False
+    for attr in ('rotatePivot', 'scalePivot', 'rotatePivotTranslate', 'scalePivotTranslate', 'rotateAxis', 'shear'):
+        if any(abs(value) > 1e-6 for value in cmds.getAttr("{}.{}".format(node, attr))[0]):
+            return False
+    if cmds.attributeQuery('offsetParentMatrix', node=node, exists=True):
+        if cmds.listConnections("{}.offsetParentMatrix".format(node), source=True, destination=False):
+            return False
+        identity = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+        if any(abs(a - b) > 1e-6 for a, b in zip(cmds.getAttr("{}.offsetParentMatrix".format(node)), identity)):
+            return False
+    return True
 
-        cmds.matchTransform(controller, loc[0], pos=True, rot=True, scl=True)
+class MatrixSampler:
+    def __init__(self):
+        self.evaluations = 0
 
-        cmds.delete(loc[0])
+    def sample(self, frame, plugs):
+        cmds.currentTime(frame, update=True)
+        self.evaluations += 1
+        return [cmds.getAttr(plug) for plug in plugs]
 
-        cmds.inViewMessage(amg="'{}' attribute switched for {}.".format(lock_attr_name, controller), pos="topCenter", fade=True)
+    def invalidate(self):
+        pass
 
-    def identify_joint(self, controller):
-        controller_suffix = self.get_suffix(controller)
+    def report(self):
+        return None
 
-        elbow_name = cmds.optionVar(q="ESwitch_Elbow")
-        knee_name = cmds.optionVar(q="ESwitch_Knee")
+class CachedPlaybackSampler(MatrixSampler):
+    # Frames held by cached playback are read by moving the time like MatrixSampler, which Maya then
+    # serves from the cache. Anything else is evaluated in a DG context for just the requested plugs, as
+    # long as there are few of them: every DG-context read evaluates on its own, so past context_plugs
+    # one time change is cheaper. Any key written invalidates the cache for the rest of the operation.
+    context_plugs = 4
 
-        return self.recursive_search(controller, controller_suffix, [elbow_name, knee_name], [])
+    def __init__(self):
+        super(CachedPlaybackSampler, self).__init__()
+        self.hits = 0
+        self.misses = 0
+        self.cached_range = None
+        self.cached_nodes = set()
+        try:
+            if cmds.evaluator(name='cache', query=True, enable=True) and not cmds.cacheEvaluator(query=True, safeModeTriggered=True):
+                self.cached_nodes = set(cmds.ls(cmds.cacheEvaluator(query=True, listCachedNodes=True) or [], long=True))
+                self.cached_range = (cmds.playbackOptions(q=True, minTime=True), cmds.playbackOptions(q=True, maxTime=True))
+        except (RuntimeError, TypeError):
+            self.cached_range = None
+
+    def is_cached(self, frame, plugs):
+        if not self.cached_range or not self.cached_range[0] <= frame <= self.cached_range[1]:
+            return False
+        nodes = set(plug.split('.', 1)[0] for plug in plugs)
+        return all(long_name in self.cached_nodes for long_name in cmds.ls(list(nodes), long=True))
+
+    def sample(self, frame, plugs):
+        if self.is_cached(frame, plugs):
+            self.hits += 1
+            return super(CachedPlaybackSampler, self).sample(frame, plugs)
+        self.misses += 1
+        if len(plugs) > self.context_plugs:
+            return super(CachedPlaybackSampler, self).sample(frame, plugs)
+        return [cmds.getAttr(plug, time=frame) for plug in plugs]
+
+    def invalidate(self):
+        # Writing keys invalidates the cache downstream of the edited curves until Maya refills it.
+        self.cached_range = None
+
+    def report(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'ratio': float(self.hits) / total if total else 0.0}
+
+def create_sampler():
+    try:
+        cache_enabled = cmds.evaluator(name='cache', query=True, enable=True)
+    except (RuntimeError, TypeError):
+        cache_enabled = False
+    return CachedPlaybackSampler() if cache_enabled else MatrixSampler()
+
+def report_sampling(sampler):
+    report = sampler.report()
+    if report:
+        print("ESwitch cached playback: {:.0%} of sampled frames read from the cache ({} hits, {} misses).".format(
+            report['ratio'], report['hits'], report['misses']))
+    return report
+
+def write_curve(node, attr_name, frames, values):
+    # Keys for the whole frame set are inserted in one call and every value on the curve is then set in
+    # one keyTimeValue write, so a curve costs two undoable edits however many frames it holds. Keys
+    # outside the frame set are written back with the values they had.
+    cmds.setKeyframe(node, attribute=attr_name, time=list(frames))
+    curve = cmds.listConnections("{}.{}".format(node, attr_name), type='animCurve', source=True, destination=False)[0]
+    times = cmds.keyframe(curve, q=True, timeChange=True)
+    current = cmds.keyframe(curve, q=True, valueChange=True)
+    written = dict((round(frame, 6), value) for frame, value in zip(frames, values))
+    pairs = []
+    for key_time, value in zip(times, current):
+        pairs += [key_time, written.get(round(key_time, 6), value)]
+    cmds.setAttr("{}.ktv[0:{}]".format(curve, len(times) - 1), *pairs)
+
+class TransformBake:
+    def __init__(self, sampler=None):
+        self.sampler = sampler or create_sampler()
+        self.targets = collections.OrderedDict()
+        self.references = {}
+        self.rotate_orders = {}
+        self.channels = {}
+        self.seeds = {}
+
+    def add(self, node, targets, references=None):
+        # references are the world matrices the node is expected to keep, when they differ from targets.
+        self.targets.setdefault(node, {}).update(targets)
+        self.references.setdefault(node, {}).update(references or targets)
+
+    def frames(self, nodes=None):
+        return sorted(set(frame for node in nodes or self.targets for frame in self.targets[node]))
+
+    def levels(self):
+        # A node below another baked node is solved only once that ancestor's keys are written, so its
+        # parent space is sampled with the new animation instead of the one being replaced.
+        paths = dict((node, cmds.ls(node, long=True)[0]) for node in self.targets)
+        baked = set(paths.values())
+        depths = {}
+        for node, path in paths.items():
+            parts = path.split('|')
+            depths[node] = sum(1 for n in range(2, len(parts)) if '|'.join(parts[:n]) in baked)
+        return [[node for node in self.targets if depths[node] == depth] for depth in sorted(set(depths.values()))]
+
+    def prepare(self):
+        for node in self.targets:
+            self.rotate_orders[node] = cmds.getAttr("{}.rotateOrder".format(node))
+            self.channels[node] = [channel for channel in TRANSFORM_CHANNELS
+                                   if cmds.getAttr("{}.{}".format(node, channel), settable=True)]
+        self.first_frames = dict((node, min(targets)) for node, targets in self.targets.items())
+        self.solved = collections.OrderedDict((node, ([], [], [], [])) for node in self.targets)
+
+    def run(self):
+        self.prepare()
+        # Each level is sampled for every frame first, then each rotate order is solved in one NumPy call.
+        for nodes in self.levels():
+            self.collect(solve_transforms(self.sample(self.frames(nodes), nodes)))
+            self.commit(nodes)
+
+    def sample(self, frames, nodes=None):
+        nodes = nodes or list(self.targets)
+        gathered = collections.OrderedDict((node, ([], [], [])) for node in nodes)
+        for frame in frames:
+            active = [node for node in nodes if frame in self.targets[node]]
+            if not active:
+                continue
+            # The rotation each node already has on its first frame rides along in the same evaluation
+            # and seeds the continuity filter, so the bake stays on the animator's branch of the curve.
+            seeded = [node for node in active if frame == self.first_frames[node]]
+            values = self.sampler.sample(frame, ["{}.parentInverseMatrix[0]".format(node) for node in active] +
+                                         ["{}.rotate".format(node) for node in seeded])
+            parent_inverses = values[:len(active)]
+            for node, rotate in zip(seeded, values[len(active):]):
+                self.seeds[node] = list(rotate[0])
+            for node, parent_inverse in zip(active, parent_inverses):
+                node_frames, targets, node_inverses = gathered[node]
+                node_frames.append(frame)
+                targets.append(self.targets[node][frame])
+                node_inverses.append(parent_inverse)
+        return [(node, self.rotate_orders[node], node_frames, targets, node_inverses)
+                for node, (node_frames, targets, node_inverses) in gathered.items() if node_frames]
+
+    def collect(self, solved):
+        for node, frames, translates, rotates, scales in solved:
+            for values, solved_values in zip(self.solved[node], (frames, translates, rotates, scales)):
+                values.extend(solved_values)
+
+    def commit(self, nodes=None):
+        # Every curve is written in one pass over the whole frame set.
+        for node in nodes or self.solved:
+            frames, translates, rotates, scales = self.solved[node]
+            rotates = filter_euler(rotates, self.rotate_orders[node], self.seeds.get(node))
+            values = {'translate': translates, 'rotate': rotates, 'scale': scales}
+            for channel in self.channels[node]:
+                axis = 'XYZ'.index(channel[-1])
+                write_curve(node, channel, frames, [value[axis] for value in values[channel[:-1]]])
+        self.sampler.invalidate()
+
+# One node to match onto target, driven by the attribute on holder (the node itself unless an
+# IK/FK style settings control carries the switch). values are the states the attribute cycles
+# through; without them the attribute toggles between its min and max. value, when given, is the
+# state to switch to instead of the next one.
+SwitchJob = collections.namedtuple('SwitchJob', ['node', 'attr_name', 'frames', 'target', 'values', 'holder', 'value'])
+SwitchJob.__new__.__defaults__ = (None, None, None)
+
+def enum_fields(node, attr_name):
+    fields = []
+    index = 0
+    for field in cmds.attributeQuery(attr_name, node=node, listEnum=True)[0].split(':'):
+        if '=' in field:
+            field, index = field.split('=')[0], int(field.split('=')[1])
+        fields.append((field, float(index)))
+        index += 1
+    return fields
+
+def resolve_target_value(node, attr_name, value):
+    # Enum fields can be named; anything else is taken as the attribute value itself.
+    if isinstance(value, str):
+        matches = [index for field, index in enum_fields(node, attr_name) if field.lower() == value.lower()]
+        return matches[0] if matches else None
+    return float(value)
+
+def resolve_values(node, attr_name, values=None):
+    if values == 'enum':
+        return [index for _, index in enum_fields(node, attr_name)]
+    if values:
+        return [float(value) for value in values]
+    return [cmds.addAttr("{}.{}".format(node, attr_name), q=True, min=True),
+            cmds.addAttr("{}.{}".format(node, attr_name), q=True, max=True)]
+
+def next_switch_value(values, value, target=None):
+    if target is not None:
+        return target
+    if len(values) == 2:
+        mid_point = values[0] + ((values[1] - values[0]) / 2)
+        return values[0] if value >= mid_point else values[1]
+    index = min(range(len(values)), key=lambda n: abs(values[n] - value))
+    return values[(index + 1) % len(values)]
+
+def bake_switch(jobs, sampler=None):
+    # Every job node is matched onto the world matrix its target had before the switch, like the
+    # per-frame locator round trip, and that matrix is also the pose verification expects it to hold.
+    jobs = [SwitchJob(*job) for job in jobs]
+    sampler = sampler or create_sampler()
+    frame_sets = [set(job.frames) for job in jobs]
+    samples = {}
+    for frame in sorted(set().union(*frame_sets)):
+        active = [index for index, frame_set in enumerate(frame_sets) if frame in frame_set]
+        plugs = []
+        for index in active:
+            job = jobs[index]
+            plugs += ["{}.worldMatrix[0]".format(job.target), "{}.{}".format(job.holder or job.node, job.attr_name)]
+        values = sampler.sample(frame, plugs)
+        for position, index in enumerate(active):
+            samples[(index, frame)] = values[position * 2:position * 2 + 2]
+
+    bake = TransformBake(sampler)
+    switched = collections.OrderedDict()
+    for index, job in enumerate(jobs):
+        holder = job.holder or job.node
+        values = job.values or resolve_values(holder, job.attr_name)
+
+        targets = {}
+        # Several matched nodes can share one holder, whose attribute is switched only once.
+        switched_values = switched.setdefault((holder, job.attr_name), {})
+        for frame in job.frames:
+            matrix, attr_value = samples[(index, frame)]
+            switched_values.setdefault(frame, next_switch_value(values, attr_value, job.value))
+            targets[frame] = matrix
+        bake.add(job.node, targets)
+
+    for (holder, attr_name), switched_values in switched.items():
+        frames = sorted(switched_values)
+        write_curve(holder, attr_name, frames, [switched_values[frame] for frame in frames])
+    sampler.invalidate()
+    bake.run()
+    return bake
+
+def finish_bake(bake, current_time):
+    drift = report_drift(verify_bake(bake)) if verification_enabled() else None
+    cmds.currentTime(current_time, update=True)
+    report_sampling(bake.sampler)
+    history.record(bake)
+    return drift
+
+def run_switch_jobs(jobs):
+    if not jobs:
+        return None
 
+    current_time = cmds.currentTime(q=True)
+    drift = finish_bake(bake_switch(jobs), current_time)
+
+    for job in jobs:
+        cmds.inViewMessage(amg="'{}' attribute switched for {}.".format(job.attr_name, job.node), pos="topCenter", fade=True)
+    return drift
+
+def measure_drift(expected, actual):
+    if numpy is None:
+        position_errors = []
+        rotation_errors = []
+        for a, b in zip(expected, actual):
+            position_errors.append(math.sqrt(sum((a[12 + n] - b[12 + n]) ** 2 for n in range(3))))
+            cosine = 0.0
+            for row in range(3):
+                row_a = a[row * 4:row * 4 + 3]
+                row_b = b[row * 4:row * 4 + 3]
+                length = (math.sqrt(sum(v * v for v in row_a)) * math.sqrt(sum(v * v for v in row_b))) or 1.0
+                cosine += sum(x * y for x, y in zip(row_a, row_b)) / length
+            rotation_errors.append(math.degrees(math.acos(max(-1.0, min(1.0, (cosine - 1.0) / 2.0)))))
+        return position_errors, rotation_errors
+
+    a = numpy.asarray(expected, dtype=float).reshape(-1, 4, 4)
+    b = numpy.asarray(actual, dtype=float).reshape(-1, 4, 4)
+    position_errors = numpy.linalg.norm(a[:, 3, :3] - b[:, 3, :3], axis=1)
+    rows_a = a[:, :3, :3] / (numpy.linalg.norm(a[:, :3, :3], axis=2)[:, :, None] + 1e-12)
+    rows_b = b[:, :3, :3] / (numpy.linalg.norm(b[:, :3, :3], axis=2)[:, :, None] + 1e-12)
+    # trace(Ra * Rb^T) is the element-wise sum of the two rotations.
+    cosine = (numpy.einsum('nij,nij->n', rows_a, rows_b) - 1.0) / 2.0
+    rotation_errors = numpy.degrees(numpy.arccos(numpy.clip(cosine, -1.0, 1.0)))
+    return position_errors.tolist(), rotation_errors.tolist()
+
+def verify_bake(bake, position_tolerance=0.001, rotation_tolerance=0.01):
+    nodes = list(bake.references)
+    actual = dict((node, {}) for node in nodes)
+    for frame in bake.frames():
+        active = [node for node in nodes if frame in bake.references[node]]
+        matrices = bake.sampler.sample(frame, ["{}.worldMatrix[0]".format(node) for node in active])
+        for node, matrix in zip(active, matrices):
+            actual[node][frame] = matrix
+
+    report = collections.OrderedDict()
+    for node in nodes:
+        frames = sorted(bake.references[node])
+        position_errors, rotation_errors = measure_drift([bake.references[node][frame] for frame in frames],
+                                                         [actual[node][frame] for frame in frames])
+        report[node] = {
+            'max_position': max(position_errors),
+            'max_rotation': max(rotation_errors),
+            'frames': [frame for frame, position, rotation in zip(frames, position_errors, rotation_errors)
+                       if position > position_tolerance or rotation > rotation_tolerance],
+        }
+    return report
+
+def verification_enabled():
+    return not cmds.optionVar(exists="ESwitch_Verify") or bool(cmds.optionVar(q="ESwitch_Verify"))
+
+def report_drift(report):
+    for node, result in report.items():
+        if result['frames']:
+            print("ESwitch drift on {}: {:.4f} units, {:.3f} degrees at frames {}.".format(
+                node, result['max_position'], result['max_rotation'], ", ".join("{:g}".format(f) for f in result['frames'])))
+            cmds.inViewMessage(amg="{} drifted on {} frames. See the Script Editor.".format(node, len(result['frames'])), pos="topCenter", fade=True)
+    return report
+
+def benchmark_solve(nodes=None, frames=None):
+    # Compares solving every node and frame on its own, as the per-frame tools do, with the batched solve.
+    nodes = nodes or cmds.ls(selection=True)
+    if frames is None:
+        start, end = cmds.playbackOptions(q=True, minTime=True), cmds.playbackOptions(q=True, maxTime=True)
+        frames = list(range(int(start), int(end) + 1))
+    current_time = cmds.currentTime(q=True)
+
+    bake = TransformBake()
+    for node in nodes:
+        bake.add(node, {frame: cmds.getAttr("{}.worldMatrix[0]".format(node)) for frame in frames})
+    bake.prepare()
+    samples = bake.sample(bake.frames())
+    cmds.currentTime(current_time, update=True)
+
+    timings = {}
+    started = time.perf_counter()
+    for node, rotate_order, _, targets, parent_inverses in samples:
+        for target, parent_inverse in zip(targets, parent_inverses):
+            decompose_matrix(multiply_matrix(target, parent_inverse), rotate_order)
+    timings['per_frame'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    solve_transforms(samples)
+    timings['batched'] = time.perf_counter() - started
+
+    print("ESwitch solve on {} nodes x {} frames: per frame {:.3f}s, batched {:.3f}s ({:.2f}x)".format(
+        len(nodes), len(frames), timings['per_frame'], timings['batched'],
+        timings['per_frame'] / max(timings['batched'], 1e-9)))
+    return timings
+
+def split_spans(frames, span_size):
+    return [(frames[i], frames[min(i + span_size, len(frames)) - 1]) for i in range(0, len(frames), span_size)]
+
+class OperationRecord:
+    # What a batched bake produced: the world matrices each node has to hold per frame, and a hash of
+    # the anim curves feeding the node's parent space for every span of those frames.
+    def __init__(self, bake, span_size=24):
+        self.targets = dict((node, dict(targets)) for node, targets in bake.targets.items())
+        self.references = dict((node, dict(references)) for node, references in bake.references.items())
+        self.spans = dict((node, split_spans(sorted(targets), span_size)) for node, targets in self.targets.items())
+        self.hashes = self.hash_inputs()
 
     @staticmethod
-    def get_suffix(name):
-        match = re.search(r'[lr]$', name, re.IGNORECASE)
-        if match:
-            return match.group(0)
-        else:
-            return None
-
-    def recursive_search(self, node, suffix, joint_names, checked_nodes):
-        connected_nodes = [n for n in cmds.listConnections(node) or [] if n not in checked_nodes]
+    def dag_ancestors(nodes):
+        ancestors = set()
+        for path in cmds.ls(nodes, long=True) or []:
+            parts = path.split('|')
+            ancestors.update('|'.join(parts[:n]) for n in range(2, len(parts)))
+        return ancestors
 
-        for node in connected_nodes:
-            if isinstance(node, str) and suffix.lower() in node.lower() and any(joint_name in node for joint_name in joint_names):
-                return node
-            else:
-                checked_nodes.append(node)
-                result = self.recursive_search(node, suffix, joint_names, checked_nodes)
-                if result:
-                    return result
+    @staticmethod
+    def input_curves(node):
+        # listHistory follows DG connections but not DAG parents, so the ancestors of the node and of
+        # every transform found upstream (constraint and space targets) are walked as well.
+        # Curves on the node itself are what the bake writes (and the switch attribute), not inputs.
+        own = set(cmds.listConnections(node, type='animCurve', source=True, destination=False) or [])
+        curves = set()
+        visited = set()
+        pending = OperationRecord.dag_ancestors([node])
+        while pending:
+            visited |= pending
+            upstream = cmds.listHistory(sorted(pending)) or []
+            curves.update(cmds.ls(upstream, type='animCurve') or [])
+            pending = OperationRecord.dag_ancestors(cmds.ls(upstream, type='transform') or []) - visited
+        return sorted(curves - own)
 
+    @staticmethod
+    def read_curve(curve):
+        return list(zip(cmds.keyframe(curve, q=True, timeChange=True) or [],
+                        cmds.keyframe(curve, q=True, valueChange=True) or [],
+                        cmds.keyTangent(curve, q=True, inAngle=True) or [],
+                        cmds.keyTangent(curve, q=True, outAngle=True) or []))
+
+    def hash_inputs(self):
+        hashes = {}
+        for node, spans in self.spans.items():
+            curves = [(curve, self.read_curve(curve)) for curve in self.input_curves(node)]
+            node_hashes = []
+            for start, end in spans:
+                # The keys just outside a span shape its interpolation, so they are part of its hash.
+                span_keys = []
+                for curve, keys in curves:
+                    times = [key[0] for key in keys]
+                    first = max(bisect.bisect_left(times, start) - 1, 0)
+                    last = bisect.bisect_right(times, end) + 1
+                    span_keys.append((curve, tuple(keys[first:last])))
+                node_hashes.append(hash(tuple(span_keys)))
+            hashes[node] = node_hashes
+        return hashes
+
+    def dirty_frames(self):
+        hashes = self.hash_inputs()
+        dirty = {}
+        for node, spans in self.spans.items():
+            for (start, end), old, new in zip(spans, self.hashes[node], hashes[node]):
+                if old != new:
+                    dirty.setdefault(node, []).extend(frame for frame in sorted(self.targets[node]) if start <= frame <= end)
+        return dirty, hashes
+
+class OperationHistory:
+    def __init__(self):
+        self.records = {}
+
+    def clear(self):
+        self.records.clear()
+
+    def record(self, bake):
+        operation = OperationRecord(bake)
+        for node in operation.targets:
+            self.records[node] = operation
+        return operation
+
+    def reapply(self, nodes):
+        operations = []
+        for node in nodes:
+            operation = self.records.get(node)
+            if operation is not None and operation not in operations:
+                operations.append(operation)
+
+        rewritten = {}
+        for operation in operations:
+            dirty, hashes = operation.dirty_frames()
+            dirty = dict((node, frames) for node, frames in dirty.items() if cmds.objExists(node))
+            if dirty:
+                bake = TransformBake()
+                for node, frames in dirty.items():
+                    bake.add(node, dict((frame, operation.targets[node][frame]) for frame in frames),
+                             dict((frame, operation.references[node][frame]) for frame in frames))
+                bake.run()
+                if verification_enabled():
+                    report_drift(verify_bake(bake))
+                rewritten.update(dirty)
+            operation.hashes = hashes
+        return rewritten
+
+history = lifecycle.register_cache('history', OperationHistory())
+
+def reapply(nodes=None):
+    # Re-runs the last switch or snap on the given nodes, rewriting only the spans whose parent space
+    # animation changed since, instead of baking the whole range again.
+    nodes = nodes or cmds.ls(selection=True)
+    current_time = cmds.currentTime(q=True)
+    cmds.undoInfo(openChunk=True)
+    rewritten = history.reapply(nodes)
+    cmds.undoInfo(closeChunk=True)
+    cmds.currentTime(current_time, update=True)
+
+    if rewritten:
+        for node, frames in rewritten.items():
+            cmds.inViewMessage(amg="Re-applied {} frames for {}.".format(len(frames), node), pos="topCenter", fade=True)
+    else:
+        cmds.inViewMessage(amg="Nothing changed since the last switch.", pos="topCenter", fade=True)
+    return rewritten
+
+def mirror_name(name):
+    suffix = Lock.get_suffix(name)
+    if not suffix:
+        return None
+    other = {'l': 'r', 'r': 'l'}[suffix.lower()]
+    return name[:-1] + (other.upper() if suffix.isupper() else other)
+
+def resolve_attr_name(node, attr_name):
+    # Switch attributes are matched case-insensitively; Maya queries need the name as it was created.
+    attrs = cmds.listAttr(node) or []
+    lowered = [attr.lower() for attr in attrs]
+    if attr_name.lower() not in lowered:
         return None
+    return attrs[lowered.index(attr_name.lower())]
 
-class WorldSnap:
+class MirrorIndex:
+    # Maps every controller carrying a switch attribute to its L/R counterpart. Built once per
+    # attribute from a single ls query and dropped by the lifecycle on scene changes.
     def __init__(self):
+        self.pairs = {}
+
+    def clear(self):
+        self.pairs.clear()
+
+    def build(self, attr_name):
+        nodes = set(cmds.ls("*.{}".format(attr_name), "*:*.{}".format(attr_name), objectsOnly=True) or [])
+        pairs = {}
+        for node in nodes:
+            counterpart = mirror_name(node)
+            if counterpart in nodes:
+                pairs[node] = counterpart
+        return pairs
+
+    def counterpart(self, node, attr_name):
+        if attr_name not in self.pairs:
+            self.pairs[attr_name] = self.build(attr_name)
+        return self.pairs[attr_name].get(node)
+
+mirror_index = lifecycle.register_cache('mirror_index', MirrorIndex())
+
+def expand_mirrored(nodes, attr_name):
+    expanded = []
+    for node in nodes:
+        resolved = resolve_attr_name(node, attr_name) if cmds.objExists(node) else None
+        for item in (node, mirror_index.counterpart(node, resolved) if resolved else None):
+            if item and item not in expanded and cmds.objExists(item):
+                expanded.append(item)
+    return expanded
+
+class WorldSnap:
+    def __init__(self, ranges=None, frames=None):
         self.selected_objects = cmds.ls(selection=True)
-        self.time_slider_selection = cmds.timeControl("timeControl1", q=True, rangeArray=True)
+        self.frame_ranges = resolve_frame_ranges(ranges, frames)
         self.current_selection = cmds.ls(selection=True)
         self.current_tool = cmds.currentCtx()
 
@@ -765,9 +1385,19 @@ class WorldSnap:
             cmds.setToolTo(self.current_tool)
             return
 
+        self.bake = TransformBake()
+        self.drift = None
+        self.current_time = cmds.currentTime(q=True)
+
         for obj in self.selected_objects:
             self.process_object(obj)
 
+        if self.bake.targets:
+            self.bake.run()
+            self.drift = finish_bake(self.bake, self.current_time)
+            for obj in self.bake.targets:
+                cmds.inViewMessage(amg="World Snap processed for {}.".format(obj), pos="topCenter", fade=True)
+
         cmds.setToolTo(self.current_tool)
         if self.current_selection:
             cmds.select(self.current_selection)
@@ -778,15 +1408,21 @@ class WorldSnap:
         if not self.selected_objects:
             cmds.inViewMessage(amg="No objects selected. Please select objects.", pos="topCenter", fade=True)
             return False
-        elif not self.time_slider_selection:
+        elif not self.frame_ranges:
             cmds.inViewMessage(amg="No time range selected. Please select a time range.", pos="topCenter", fade=True)
             return False
         return True
 
     def process_object(self, obj):
+        keyframes = frames_in_ranges(self.frame_ranges)
+
+        if supports_batch(obj):
+            world_matrix = cmds.getAttr("{}.worldMatrix[0]".format(obj))
+            self.bake.add(obj, dict((keyframe, world_matrix) for keyframe in keyframes))
+            return
+
         loc = cmds.spaceLocator(name="Locator#{}".format(obj))
         cmds.matchTransform(loc[0], obj, pos=True, rot=True, scl=True)
-        keyframes = range(int(self.time_slider_selection[0]), int(self.time_slider_selection[1]) + 1)
         
         if keyframes:
             for keyframe in keyframes:
@@ -801,9 +1437,9 @@ class WorldSnap:
         cmds.inViewMessage(amg="World Snap processed for {}.".format(obj), pos="topCenter", fade=True)
 
 class ObjSnap:
-    def __init__(self):
+    def __init__(self, ranges=None, frames=None):
         self.selected_objects = cmds.ls(selection=True)
-        self.time_slider_selection = cmds.timeControl("timeControl1", q=True, rangeArray=True)
+        self.frame_ranges = resolve_frame_ranges(ranges, frames)
         self.current_selection = cmds.ls(selection=True)
         self.current_tool = cmds.currentCtx()
 
@@ -829,28 +1465,271 @@ class ObjSnap:
         if not self.selected_objects or len(self.selected_objects) != 2:
             cmds.inViewMessage(amg="Please select two objects. The first one should be the target, and the second one should be the child.", pos="topCenter", fade=True)
             return False
-        elif not self.time_slider_selection:
+        elif not self.frame_ranges:
             cmds.inViewMessage(amg="No time range selected. Please select a time range.", pos="topCenter", fade=True)
             return False
         return True
 
     def process_object(self):
-        loc = cmds.spaceLocator(name="Locator#{}".format(self.target_object))
-        cmds.pointConstraint(self.target_object, loc, maintainOffset=False)
-        
         control_parent = cmds.listRelatives(self.control_object, parent=True)[0]
-        constraint = cmds.pointConstraint(loc, control_parent, maintainOffset=True)
-        
-        keyframes = range(int(self.time_slider_selection[0]), int(self.time_slider_selection[1]) + 1)
-        if keyframes:
+        keyframes = frames_in_ranges(self.frame_ranges)
+
+        # The point constraint follows the target's rotate pivot, which is its world translation only without pivot offsets.
+        if supports_batch(control_parent) and supports_batch(self.target_object):
+            self.process_batch(control_parent, keyframes)
+        else:
+            loc = cmds.spaceLocator(name="Locator#{}".format(self.target_object))
+            cmds.pointConstraint(self.target_object, loc, maintainOffset=False)
+
+            constraint = cmds.pointConstraint(loc, control_parent, maintainOffset=True)
+
+            if keyframes:
+                for keyframe in keyframes:
+                    cmds.currentTime(keyframe)
+                    cmds.setKeyframe(control_parent, attribute='translate')
+
+            cmds.delete(constraint)
+            cmds.delete(loc)
+
+        cmds.inViewMessage(amg="Object Snap processed for {}.".format(self.control_object), pos="topCenter", fade=True)
+
+    def process_batch(self, control_parent, keyframes):
+        # Same result as the point constraint with maintained offset, from one sampling pass.
+        current_time = cmds.currentTime(q=True)
+        sampler = create_sampler()
+
+        target_matrix = cmds.getAttr("{}.worldMatrix[0]".format(self.target_object))
+        parent_matrix = cmds.getAttr("{}.worldMatrix[0]".format(control_parent))
+        offset = [parent_matrix[12 + n] - target_matrix[12 + n] for n in range(3)]
+
+        translates = []
+        for keyframe in keyframes:
+            target_matrix, parent_inverse = sampler.sample(keyframe, ["{}.worldMatrix[0]".format(self.target_object),
+                                                                      "{}.parentInverseMatrix[0]".format(control_parent)])
+            point = [target_matrix[12 + n] + offset[n] for n in range(3)] + [1.0]
+            translates.append([sum(point[k] * parent_inverse[k * 4 + n] for k in range(4)) for n in range(3)])
+
+        for axis, channel in enumerate(TRANSFORM_CHANNELS[:3]):
+            if cmds.getAttr("{}.{}".format(control_parent, channel), settable=True):
+                write_curve(control_parent, channel, keyframes, [translate[axis] for translate in translates])
+
+        cmds.currentTime(current_time, update=True)
+        report_sampling(sampler)
+
+SWITCH_STRATEGIES = {}
+
+RIG_TYPES = {}
+
+plans = lifecycle.register_cache('plans', {})
+
+def register_strategy(name, resolve):
+    # resolve(node, switch) returns the (matched node, target) pairs a switch on node has to keep in place.
+    SWITCH_STRATEGIES[name] = resolve
+    plans.clear()
+
+def register_rig_type(name, switches):
+    # switches maps a switch kind to its declaration: the attribute (optionally overridden by an
+    # optionvar), the values it cycles through ('enum', explicit values or min/max when omitted),
+    # the strategy resolving what to match and the strategy's own settings such as 'targets'.
+    RIG_TYPES[name] = switches
+    plans.clear()
+
+def format_name(pattern, node):
+    side = Lock.get_suffix(node) or ''
+    return pattern.format(node=node, side=side, base=node[:len(node) - len(side)])
+
+def match_self(node, switch):
+    return [(node, node)]
+
+def joint_names():
+    return [cmds.optionVar(q="ESwitch_Elbow"), cmds.optionVar(q="ESwitch_Knee")]
+
+def match_joint(node, switch):
+    joint = Lock.identify_joint(node)
+    return [(node, joint)] if joint else []
+
+def match_targets(node, switch):
+    return [(format_name(matched, node), format_name(target, node)) for matched, target in switch['targets']]
+
+register_strategy('self', match_self)
+register_strategy('joint', match_joint)
+register_strategy('targets', match_targets)
+
+register_rig_type('default', {
+    'Follow': {'attribute': 'Follow', 'optionvar': 'ESwitch_Follow'},
+    'Global': {'attribute': 'Global', 'optionvar': 'ESwitch_Global'},
+    'GlobalTranslate': {'attribute': 'GlobalTranslate', 'optionvar': 'ESwitch_GlobalTranslate'},
+    'Lock': {'attribute': 'Lock', 'optionvar': 'ESwitch_Lock', 'strategy': 'joint'},
+})
+
+def resolve_switch(kind, rig_type=None):
+    rig_type = rig_type or cmds.optionVar(q="ESwitch_RigType") or 'default'
+    declared = RIG_TYPES.get(rig_type, {}).get(kind) or RIG_TYPES['default'].get(kind)
+    if declared is None:
+        return rig_type, None
+    switch = dict(declared)
+    if switch.get('optionvar'):
+        switch['attribute'] = cmds.optionVar(q=switch['optionvar']) or switch['attribute']
+    return rig_type, switch
+
+class SwitchPlan:
+    # A switch declaration resolved against concrete nodes once: attribute plugs and match pairs.
+    # Value sets and whether the matched nodes can take the batched path depend on attribute ranges,
+    # pivots and connections that change within a scene, so Switch checks those on every run.
+    def __init__(self, switch, nodes):
+        self.entries = []
+        self.missing = []
+        self.values = switch.get('values')
+        resolve = SWITCH_STRATEGIES[switch.get('strategy', 'self')]
+        for node in nodes:
+            attr_name = resolve_attr_name(node, switch['attribute'])
+            if attr_name is None:
+                self.missing.append((node, "No '{}' attribute found for {}. Locator not created.".format(switch['attribute'], node)))
+                continue
+
+            pairs = resolve(node, switch)
+            if not pairs or not all(cmds.objExists(name) for pair in pairs for name in pair):
+                self.missing.append((node, "No match target identified for {}. Locator not created.".format(node)))
+                continue
+
+            self.entries.append((node, attr_name, pairs))
+
+    def exists(self):
+        names = set()
+        for node, _, pairs in self.entries:
+            names.add(node)
+            names.update(name for pair in pairs for name in pair)
+        return all(cmds.objExists(name) for name in names)
+
+def compile_plan(kind, nodes, rig_type, switch):
+    # The joint strategy depends on the elbow and knee names from the settings window.
+    key = (rig_type, kind, repr(sorted(switch.items())), tuple(joint_names()), tuple(nodes))
+    if key not in plans or not plans[key].exists():
+        plans[key] = SwitchPlan(switch, nodes)
+    return plans[key]
+
+class Switch:
+    # kind is looked up in the rig type's declarations unless a one-off declaration is given. value
+    # switches to that state (an enum field name or a number) instead of cycling to the next one.
+    def __init__(self, kind, rig_type=None, ranges=None, frames=None, mirror=False, declaration=None, value=None):
+        self.selected_objects = cmds.ls(selection=True)
+        self.frame_ranges = resolve_frame_ranges(ranges, frames)
+        self.current_selection = cmds.ls(selection=True)
+        self.current_tool = cmds.currentCtx()
+
+        cmds.undoInfo(openChunk=True)
+
+        cmds.setToolTo('moveSuperContext')
+
+        self.jobs = []
+        self.drift = None
+        self.value = value
+
+        rig_type, switch = (None, dict(declaration)) if declaration else resolve_switch(kind, rig_type)
+
+        if not self.selected_objects:
+            cmds.inViewMessage(amg="No objects selected. Please select objects.", pos="topCenter", fade=True)
+        elif switch is None:
+            cmds.inViewMessage(amg="No '{}' switch declared for the '{}' rig type.".format(kind, rig_type), pos="topCenter", fade=True)
+        else:
+            if mirror:
+                self.selected_objects = expand_mirrored(self.selected_objects, switch['attribute'])
+            self.plan = compile_plan(kind, self.selected_objects, rig_type, switch)
+            for node, message in self.plan.missing:
+                cmds.inViewMessage(amg=message, pos="topCenter", fade=True)
+            for entry in self.plan.entries:
+                self.process_entry(entry)
+            self.drift = run_switch_jobs(self.jobs)
+
+        cmds.setToolTo(self.current_tool)
+
+        if self.current_selection:
+            cmds.select(self.current_selection)
+
+        cmds.undoInfo(closeChunk=True)
+
+    def process_entry(self, entry):
+        holder, attr_name, pairs = entry
+        values = resolve_values(holder, attr_name, self.plan.values)
+        target_value = None
+        if self.value is not None:
+            target_value = resolve_target_value(holder, attr_name, self.value)
+            if target_value is None:
+                cmds.inViewMessage(amg="No '{}' value found on {}.{}.".format(self.value, holder, attr_name), pos="topCenter", fade=True)
+                return
+
+        keyframes = keys_in_ranges(holder, attr_name, self.frame_ranges)
+        if keyframes and all(supports_batch(matched) for matched, _ in pairs):
+            self.jobs.extend(SwitchJob(matched, attr_name, keyframes, target, values, holder, target_value) for matched, target in pairs)
+        elif keyframes:
             for keyframe in keyframes:
                 cmds.currentTime(keyframe)
-                cmds.setKeyframe(control_parent, attribute='translate')
-        
-        cmds.delete(constraint)
-        cmds.delete(loc)
+                self.process_keyframe(holder, attr_name, values, pairs, target_value, keyframes=True)
+        else:
+            self.process_keyframe(holder, attr_name, values, pairs, target_value, keyframes=False)
+
+    def process_keyframe(self, holder, attr_name, values, pairs, target_value=None, keyframes=False):
+        locators = []
+        for matched, target in pairs:
+            loc = cmds.spaceLocator(name="Locator#{}".format(matched))
+            cmds.matchTransform(loc[0], target, pos=True, rot=True, scl=True)
+            locators.append((matched, loc[0]))
+
+        attr_value = cmds.getAttr("{}.{}".format(holder, attr_name))
+        cmds.setAttr("{}.{}".format(holder, attr_name), next_switch_value(values, attr_value, target_value))
+
+        if keyframes or cmds.keyframe(holder, attribute=attr_name, query=True):
+            cmds.setKeyframe(holder, attribute=attr_name)
+
+        for matched, loc in locators:
+            cmds.matchTransform(matched, loc, pos=True, rot=True, scl=True)
+            cmds.delete(loc)
+
+        cmds.inViewMessage(amg="'{}' attribute switched for {}.".format(attr_name, holder), pos="topCenter", fade=True)
 
-        cmds.inViewMessage(amg="Object Snap processed for {}.".format(self.control_object), pos="topCenter", fade=True)
+
+class AttributeSwitch(Switch):
+    def __init__(self, attr_name, ranges=None, frames=None, mirror=False, value=None):
+        super(AttributeSwitch, self).__init__(attr_name, ranges=ranges, frames=frames, mirror=mirror,
+                                              declaration={'attribute': attr_name}, value=value)
+
+class Lock(Switch):
+    def __init__(self, lock_attr_name, ranges=None, frames=None, mirror=False, value=None):
+        super(Lock, self).__init__(lock_attr_name, ranges=ranges, frames=frames, mirror=mirror,
+                                   declaration={'attribute': lock_attr_name, 'strategy': 'joint'}, value=value)
+
+    @staticmethod
+    def identify_joint(controller):
+        controller_suffix = Lock.get_suffix(controller)
+
+        return Lock.recursive_search(controller, controller_suffix, joint_names(), [])
+
+
+    @staticmethod
+    def get_suffix(name):
+        match = re.search(r'[lr]$', name, re.IGNORECASE)
+        if match:
+            return match.group(0)
+        else:
+            return None
+
+    @staticmethod
+    def recursive_search(node, suffix, joint_names, checked_nodes):
+        checked_nodes.append(node)
+        connected_nodes = [n for n in cmds.listConnections(node) or [] if n not in checked_nodes]
+
+        for node in connected_nodes:
+            # A deeper search may already have walked this node since the list was taken.
+            if node in checked_nodes:
+                continue
+            if isinstance(node, str) and suffix.lower() in node.lower() and any(joint_name in node for joint_name in joint_names):
+                return node
+            else:
+                result = Lock.recursive_search(node, suffix, joint_names, checked_nodes)
+                if result:
+                    return result
+
+        return None
 
 
 initial_cursor_position = QtGui.QCursor().pos()
@@ -864,6 +1743,8 @@ def create_popup_window(window_class, position_offset, name, cursor_position=Non
     return window
 
 def create_popup():
+    lifecycle.close_windows()
+    lifecycle.install()
     cursor_position = QtGui.QCursor().pos()
 
     left_window = create_popup_window(GlobalTranslatePopupWindow, QtCore.QPoint(-100, 50), 'left', cursor_position)
@@ -877,8 +1758,15 @@ def create_popup():
     bottom_small_window = create_popup_window(SettingsSmallPopupWindow, QtCore.QPoint(0, 100), 'settingssmall', cursor_position)
 
 def close_popup():
-    global windows
-    for window in windows.values():
-        if window is not None:
-            window.close()
+    lifecycle.close_windows()
+
+def teardown():
+    lifecycle.teardown()
+
+def diagnostics():
+    report = lifecycle.diagnostics()
+    print("ESwitch: {} windows, {} running timers, {} scriptJobs, caches {}.".format(
+        len(report['windows']), report['timers'], report['script_jobs'],
+        ", ".join("{} {} bytes".format(name, size) for name, size in report['caches'].items()) or "empty"))
+    return report
 
@@ -0,0 +1,482 @@
+import math
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _StubMeta(type):
+    def __getattr__(cls, name):
+        return _Stub
+
+    def __or__(cls, other):
+        return cls
+
+
+class _Stub(metaclass=_StubMeta):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return _Stub()
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __int__(self):
+        return 0
+
+    def __or__(self, other):
+        return self
+
+    def __add__(self, other):
+        return self
+
+    __sub__ = __radd__ = __rsub__ = __add__
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Stub
+
+
+IDENTITY = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+ORDERS = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')
+
+
+def _multiply(a, b):
+    return [sum(a[row * 4 + k] * b[k * 4 + col] for k in range(4)) for row in range(4) for col in range(4)]
+
+
+def _axis_matrix(axis, degrees):
+    c, s = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    if axis == 0:
+        return [1, 0, 0, 0, 0, c, s, 0, 0, -s, c, 0, 0, 0, 0, 1]
+    if axis == 1:
+        return [c, 0, -s, 0, 0, 1, 0, 0, s, 0, c, 0, 0, 0, 0, 1]
+    return [c, s, 0, 0, -s, c, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+
+
+def compose(translate, rotate, scale=(1.0, 1.0, 1.0), rotate_order=0):
+    matrix = [scale[0], 0, 0, 0, 0, scale[1], 0, 0, 0, 0, scale[2], 0, 0, 0, 0, 1]
+    for axis in ORDERS[rotate_order]:
+        index = 'xyz'.index(axis)
+        matrix = _multiply(matrix, _axis_matrix(index, rotate[index]))
+    matrix[12:15] = translate
+    return [float(v) for v in matrix]
+
+
+def inverse(matrix):
+    size = 4
+    rows = [list(matrix[r * 4:r * 4 + 4]) + [1.0 if r == c else 0.0 for c in range(4)] for r in range(size)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = rows[col][col]
+        rows[col] = [v / scale for v in rows[col]]
+        for r in range(size):
+            if r != col:
+                factor = rows[r][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[r][4 + c] for r in range(size) for c in range(size)]
+
+
+class Node(object):
+    def __init__(self, name, node_type='transform', parent=None):
+        self.name = name
+        self.type = node_type
+        self.parent = parent
+        self.values = {'translateX': 0.0, 'translateY': 0.0, 'translateZ': 0.0,
+                       'rotateX': 0.0, 'rotateY': 0.0, 'rotateZ': 0.0,
+                       'scaleX': 1.0, 'scaleY': 1.0, 'scaleZ': 1.0,
+                       'rotateOrder': 0}
+        self.curves = {}
+        self.ranges = {}
+        self.space = None
+        self.connections = []
+        self.inputs = []
+        self.enums = {}
+        self.pivots = {}
+
+
+class FakeCmds(types.ModuleType):
+    """A recording stand-in for maya.cmds evaluating a tiny transform hierarchy."""
+
+    def __init__(self):
+        super(FakeCmds, self).__init__('maya.cmds')
+        self.nodes = {}
+        self.calls = []
+        self.selection = []
+        self.time = 1.0
+        self.time_range = None
+        self.option_vars = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return None
+        return command
+
+    # -- scene building -----------------------------------------------------------------------
+
+    def add_node(self, name, node_type='transform', parent=None, **values):
+        node = Node(name, node_type, parent)
+        node.values.update(values)
+        self.nodes[name] = node
+        return node
+
+    def key(self, name, attr, keys):
+        self.nodes[name].curves.setdefault(attr, {}).update(dict((float(f), float(v)) for f, v in keys.items()))
+
+    def count(self, name, **match):
+        return sum(1 for call, args, kwargs in self.calls if call == name
+                   and all(kwargs.get(k) == v for k, v in match.items()))
+
+    def reset_calls(self):
+        self.calls = []
+
+    # -- evaluation ---------------------------------------------------------------------------
+
+    def value(self, name, attr, frame):
+        node = self.nodes[name]
+        curve = node.curves.get(attr)
+        if not curve:
+            return node.values[attr]
+        frames = sorted(curve)
+        if frame <= frames[0]:
+            return curve[frames[0]]
+        if frame >= frames[-1]:
+            return curve[frames[-1]]
+        for start, end in zip(frames, frames[1:]):
+            if start <= frame <= end:
+                weight = (frame - start) / (end - start)
+                return curve[start] + (curve[end] - curve[start]) * weight
+
+    def local_matrix(self, name, frame):
+        v = lambda attr: self.value(name, attr, frame)
+        return compose([v('translateX'), v('translateY'), v('translateZ')],
+                       [v('rotateX'), v('rotateY'), v('rotateZ')],
+                       [v('scaleX'), v('scaleY'), v('scaleZ')],
+                       int(self.nodes[name].values['rotateOrder']))
+
+    def world_matrix(self, name, frame):
+        if name is None:
+            return list(IDENTITY)
+        node = self.nodes[name]
+        parent = node.space(self, frame) if node.space else node.parent
+        return _multiply(self.local_matrix(name, frame), self.world_matrix(parent, frame))
+
+    # -- commands -----------------------------------------------------------------------------
+
+    def _record(self, name, args, kwargs):
+        self.calls.append((name, args, kwargs))
+
+    def ls(self, *args, **kwargs):
+        self._record('ls', args, kwargs)
+        if kwargs.get('selection') or kwargs.get('sl'):
+            return list(self.selection)
+        if args and isinstance(args[0], str) and args[0] in self.nodes:
+            args = ([args[0]],) + args[1:]
+        if args and isinstance(args[0], list):
+            items = [item.split('|')[-1] for item in args[0]]
+            if kwargs.get('type') == 'animCurve':
+                return [item for item in items if self.curve(item)]
+            if kwargs.get('type') == 'transform':
+                items = [item for item in items if item in self.nodes and self.nodes[item].type in ('transform', 'joint')]
+            if kwargs.get('long'):
+                return [self.long_name(item) if item in self.nodes else item for item in items]
+            return items
+        if args:
+            attrs = set(pattern.split('.', 1)[1] for pattern in args if '.' in pattern and ':' not in pattern)
+            return [name for name, node in self.nodes.items() if attrs & set(node.values)]
+        return list(self.nodes)
+
+    def select(self, *args, **kwargs):
+        self._record('select', args, kwargs)
+
+    def timeControl(self, *args, **kwargs):
+        self._record('timeControl', args, kwargs)
+        return list(self.time_range) if self.time_range else None
+
+    def playbackOptions(self, *args, **kwargs):
+        self._record('playbackOptions', args, kwargs)
+        return 1.0 if kwargs.get('minTime') else 10.0
+
+    def currentCtx(self, *args, **kwargs):
+        self._record('currentCtx', args, kwargs)
+        return 'selectSuperContext'
+
+    def optionVar(self, *args, **kwargs):
+        self._record('optionVar', args, kwargs)
+        if 'exists' in kwargs:
+            return kwargs['exists'] in self.option_vars
+        if 'q' in kwargs:
+            return self.option_vars.get(kwargs['q'], 0)
+        for flag in ('sv', 'iv', 'fv'):
+            if flag in kwargs:
+                self.option_vars[kwargs[flag][0]] = kwargs[flag][1]
+
+    def currentTime(self, *args, **kwargs):
+        self._record('currentTime', args, kwargs)
+        if kwargs.get('q') or kwargs.get('query'):
+            return self.time
+        self.time = float(args[0])
+        return self.time
+
+    def nodeType(self, name, **kwargs):
+        self._record('nodeType', (name,), kwargs)
+        return self.nodes[name].type
+
+    def objExists(self, name, **kwargs):
+        self._record('objExists', (name,), kwargs)
+        return name.split('.')[0] in self.nodes
+
+    def attributeQuery(self, attr, **kwargs):
+        self._record('attributeQuery', (attr,), kwargs)
+        if kwargs.get('listEnum'):
+            return [self.nodes[kwargs['node']].enums[attr]]
+        return attr != 'offsetParentMatrix' and attr in self.nodes[kwargs['node']].values
+
+    def listAttr(self, name, **kwargs):
+        self._record('listAttr', (name,), kwargs)
+        return list(self.nodes[name].values)
+
+    def listConnections(self, plug, **kwargs):
+        self._record('listConnections', (plug,), kwargs)
+        if kwargs.get('type') == 'animCurve':
+            if '.' in plug:
+                name, attr = plug.split('.', 1)
+                return ['{}_{}'.format(name, attr)] if attr in self.nodes[name].curves else None
+            return ['{}_{}'.format(plug, attr) for attr in sorted(self.nodes[plug].curves)] or None
+        if '.' in plug:
+            return None
+        return list(self.nodes[plug].connections) or None
+
+    def curve(self, name):
+        if name in self.nodes or '_' not in name:
+            return None
+        node, attr = name.rsplit('_', 1)
+        return self.nodes[node].curves.get(attr) if node in self.nodes else None
+
+    def long_name(self, name):
+        path = []
+        while name is not None:
+            path.insert(0, name)
+            name = self.nodes[name].parent
+        return '|' + '|'.join(path)
+
+    def listHistory(self, name, **kwargs):
+        # Like Maya, history follows DG connections (inputs) but not DAG parents.
+        self._record('listHistory', (name,), kwargs)
+        history = []
+        pending = [item.split('|')[-1] for item in (name if isinstance(name, list) else [name])]
+        while pending:
+            item = pending.pop()
+            if item in history:
+                continue
+            history.append(item)
+            node = self.nodes[item]
+            history.extend('{}_{}'.format(item, attr) for attr in sorted(node.curves))
+            pending.extend(node.inputs)
+        return history
+
+    def keyTangent(self, name, **kwargs):
+        self._record('keyTangent', (name,), kwargs)
+        return [0.0] * len(self.curve(name) or {})
+
+    def listRelatives(self, name, **kwargs):
+        self._record('listRelatives', (name,), kwargs)
+        parent = self.nodes[name].parent
+        return [parent] if kwargs.get('parent') and parent else None
+
+    def addAttr(self, plug, **kwargs):
+        self._record('addAttr', (plug,), kwargs)
+        name, attr = plug.split('.', 1)
+        low, high = self.nodes[name].ranges.get(attr, (0.0, 1.0))
+        if kwargs.get('min'):
+            return low
+        if kwargs.get('max'):
+            return high
+
+    def getAttr(self, plug, **kwargs):
+        self._record('getAttr', (plug,), kwargs)
+        name, attr = plug.split('.', 1)
+        frame = float(kwargs.get('time', self.time))
+        if kwargs.get('settable'):
+            return True
+        if attr == 'worldMatrix[0]':
+            return self.world_matrix(name, frame)
+        if attr == 'parentInverseMatrix[0]':
+            node = self.nodes[name]
+            parent = node.space(self, frame) if node.space else node.parent
+            return inverse(self.world_matrix(parent, frame))
+        if attr in ('rotatePivot', 'scalePivot', 'rotatePivotTranslate', 'scalePivotTranslate', 'rotateAxis', 'shear'):
+            return [tuple(self.nodes[name].pivots.get(attr, (0.0, 0.0, 0.0)))]
+        if attr in ('translate', 'rotate', 'scale'):
+            return [tuple(self.value(name, attr + axis, frame) for axis in 'XYZ')]
+        if attr == 'rotateOrder':
+            return int(self.nodes[name].values['rotateOrder'])
+        return self.value(name, attr, frame)
+
+    def setAttr(self, plug, *values, **kwargs):
+        self._record('setAttr', (plug,) + values, kwargs)
+        name, attr = plug.split('.', 1)
+        if attr.startswith('ktv['):
+            # A keyTimeValue write replaces the keys of the curve from its flat time, value pairs.
+            curve = self.curve(name)
+            curve.clear()
+            curve.update(zip(values[0::2], values[1::2]))
+            return
+        value = values[0]
+        self.nodes[name].values[attr] = value
+        self.nodes[name].curves.pop(attr, None)
+
+    def keyframe(self, name, **kwargs):
+        self._record('keyframe', (name,), kwargs)
+        if name not in self.nodes:
+            curve = self.curve(name) or {}
+            if kwargs.get('valueChange'):
+                return [curve[f] for f in sorted(curve)]
+            return sorted(curve)
+        curve = self.nodes[name].curves.get(kwargs.get('attribute'))
+        if not curve:
+            return None
+        frames = sorted(curve)
+        if 'time' in kwargs:
+            start, end = kwargs['time']
+            frames = [f for f in frames if start <= f <= end]
+        return frames or None
+
+    def setKeyframe(self, name, **kwargs):
+        self._record('setKeyframe', (name,), kwargs)
+        node = self.nodes[name]
+        attrs = [kwargs['attribute']] if 'attribute' in kwargs else [a for a in node.values if a != 'rotateOrder']
+        if attrs[0] in ('translate', 'rotate', 'scale'):
+            attrs = [attrs[0] + axis for axis in 'XYZ']
+        frames = kwargs.get('time', self.time)
+        for frame in (frames if isinstance(frames, list) else [frames]):
+            frame = float(frame)
+            values = [(attr, kwargs.get('value', self.value(name, attr, frame))) for attr in attrs]
+            for attr, value in values:
+                node.curves.setdefault(attr, {})[frame] = float(value)
+
+    def spaceLocator(self, **kwargs):
+        self._record('spaceLocator', (), kwargs)
+        name = 'locator{}'.format(len(self.nodes))
+        self.add_node(name, 'transform')
+        return [name]
+
+    def delete(self, name, **kwargs):
+        self._record('delete', (name,), kwargs)
+        for item in (name if isinstance(name, list) else [name]):
+            self.nodes.pop(item, None)
+
+    def matchTransform(self, name, target, **kwargs):
+        import ESwitcher
+        self._record('matchTransform', (name, target), kwargs)
+        node = self.nodes[name]
+        local = _multiply(self.world_matrix(target, self.time),
+                          inverse(self.world_matrix(node.space(self, self.time) if node.space else node.parent, self.time)))
+        translate, rotate, scale = ESwitcher.decompose_matrix(local, int(node.values['rotateOrder']))
+        for prefix, values in (('translate', translate), ('rotate', rotate), ('scale', scale)):
+            for axis, value in zip('XYZ', values):
+                attr = prefix + axis
+                if attr in node.curves:
+                    node.curves[attr][self.time] = value
+                node.values[attr] = value
+
+
+def build_switch_rig(cmds, count=1, frames=(1, 5, 10), attr='Follow'):
+    cmds.add_node('spaceA', translateX=2.0)
+    cmds.add_node('spaceB', translateY=3.0)
+    cmds.key('spaceA', 'rotateY', {1: 0.0, 10: 90.0})
+    cmds.key('spaceB', 'translateZ', {1: 0.0, 10: 20.0})
+    controls = []
+    for index in range(count):
+        name = 'arm{}_ctrl_l'.format(index)
+        node = cmds.add_node(name, translateX=float(index), rotateZ=15.0 * index, rotateOrder=index % 6)
+        node.values[attr] = 0.0
+        cmds.key(name, attr, dict((f, 0.0) for f in frames))
+        cmds.key(name, 'translateX', {frames[0]: float(index), frames[-1]: float(index) + 4.0})
+        node.space = lambda fake, frame, name=name: 'spaceB' if fake.value(name, attr, frame) >= 0.5 else 'spaceA'
+        controls.append(name)
+    return controls
+
+
+def build_lock_rig(cmds, count=1, frames=(1, 5, 10), mirrored=False):
+    cmds.option_vars.update({'ESwitch_Elbow': 'Elbow', 'ESwitch_Knee': 'Knee'})
+    cmds.add_node('hips', translateY=9.0)
+    cmds.key('hips', 'translateZ', {frames[0]: 0.0, frames[-1]: 6.0})
+    controllers = []
+    for index in range(count):
+        side = 'lr'[index % 2]
+        # Mirrored rigs pair every left leg with a right one of the same name.
+        prefix = 'leg{}'.format(index // 2 if mirrored else index)
+        name = '{}_knee_ctrl_{}'.format(prefix, side)
+        joint = '{}_Knee_jnt_{}'.format(prefix, side)
+        solver = '{}_ikHandle_{}'.format(prefix, side)
+        cmds.add_node(joint, parent='hips', translateX=float(index), translateY=-4.0)
+        cmds.key(joint, 'rotateX', {frames[0]: 0.0, frames[-1]: 60.0 + index})
+        cmds.add_node(solver).connections = [name, joint]
+        node = cmds.add_node(name, translateX=float(index), translateZ=3.0)
+        node.values['Lock'] = 0.0
+        node.connections = [solver]
+        cmds.key(name, 'Lock', dict((f, 0.0) for f in frames))
+        node.space = lambda fake, frame, name=name: 'hips' if fake.value(name, 'Lock', frame) >= 0.5 else None
+        controllers.append((name, joint))
+    return controllers
+
+
+def assert_matrix_close(a, b, tolerance=1e-6):
+    assert max(abs(x - y) for x, y in zip(a, b)) < tolerance
+
+
+def _install_stubs():
+    maya = types.ModuleType('maya')
+    cmds = FakeCmds()
+    maya.cmds = cmds
+    sys.modules['maya'] = maya
+    sys.modules['maya.cmds'] = cmds
+    for name in ('maya.OpenMayaUI', 'maya.OpenMaya', 'PySide2', 'PySide2.QtCore', 'PySide2.QtGui',
+                 'PySide2.QtWidgets', 'shiboken2'):
+        sys.modules[name] = _StubModule(name)
+        if name.startswith('maya.'):
+            setattr(maya, name.split('.')[1], sys.modules[name])
+    pyside = sys.modules['PySide2']
+    for name in ('QtCore', 'QtGui', 'QtWidgets'):
+        setattr(pyside, name, sys.modules['PySide2.' + name])
+    return cmds
+
+
+_install_stubs()
+
+
+@pytest.fixture
+def cmds(monkeypatch):
+    import ESwitcher
+    fake = FakeCmds()
+    monkeypatch.setitem(sys.modules, 'maya.cmds', fake)
+    monkeypatch.setattr(sys.modules['maya'], 'cmds', fake)
+    monkeypatch.setattr(ESwitcher, 'cmds', fake)
+    ESwitcher.lifecycle.clear_caches()
+    yield fake
+    ESwitcher.lifecycle.clear_caches()
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def math_backend(request, monkeypatch):
+    import ESwitcher
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(ESwitcher, 'numpy', None)
+    return request.param
@@ -0,0 +1,199 @@
+import pytest
+
+import ESwitcher
+from conftest import build_lock_rig, build_switch_rig
+
+
+SIZES = (1, 4, 16)
+
+
+def evaluations(cmds):
+    # A scene evaluation is either a time change or a DG-context getAttr.
+    return cmds.count('currentTime', update=True) + sum(
+        1 for call, args, kwargs in cmds.calls if call == 'getAttr' and 'time' in kwargs)
+
+
+def run_attribute_switch(cmds, count, frames):
+    controls = build_switch_rig(cmds, count=count, frames=frames)
+    cmds.selection = controls
+    cmds.time_range = (float(frames[0]), float(frames[-1]))
+    cmds.reset_calls()
+    ESwitcher.AttributeSwitch('Follow')
+    return controls
+
+
+def run_lock(cmds, count, frames):
+    controllers = build_lock_rig(cmds, count=count, frames=frames)
+    cmds.selection = [name for name, _ in controllers]
+    cmds.time_range = (float(frames[0]), float(frames[-1]))
+    cmds.reset_calls()
+    ESwitcher.Lock('Lock')
+    return [name for name, _ in controllers]
+
+
+def run_world_snap(cmds, count, frames):
+    controls = build_switch_rig(cmds, count=count, frames=frames)
+    cmds.selection = controls
+    cmds.time_range = (float(frames[0]), float(frames[-1]))
+    cmds.reset_calls()
+    ESwitcher.WorldSnap()
+    return controls
+
+
+ENGINES = {
+    'AttributeSwitch': run_attribute_switch,
+    'Lock': run_lock,
+    'WorldSnap': run_world_snap,
+}
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_evaluations_do_not_grow_with_object_count(cmds, engine):
+    frames = tuple(range(1, 13))
+    counts = []
+    for count in SIZES:
+        fake = type(cmds)()
+        ESwitcher.cmds = fake
+        ESwitcher.lifecycle.clear_caches()
+        ENGINES[engine](fake, count, frames)
+        counts.append(evaluations(fake))
+
+    assert len(set(counts)) == 1
+    # Switch, verification and time restore passes: at most three per frame plus one.
+    assert counts[0] <= 3 * len(frames) + 1
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_evaluations_grow_linearly_with_frames(cmds, engine):
+    counts = []
+    for length in (10, 40):
+        fake = type(cmds)()
+        ESwitcher.cmds = fake
+        ESwitcher.lifecycle.clear_caches()
+        ENGINES[engine](fake, 4, tuple(range(1, length + 1)))
+        counts.append(evaluations(fake))
+
+    assert counts[1] <= 4 * counts[0] + 1
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+@pytest.mark.parametrize('count', SIZES)
+def test_no_locator_churn_and_one_write_per_curve(cmds, engine, count):
+    frames = tuple(range(1, 9))
+    nodes = ENGINES[engine](cmds, count, frames)
+
+    assert cmds.count('spaceLocator') == 0
+    assert cmds.count('matchTransform') == 0
+    assert cmds.count('delete') == 0
+    switched = 0 if engine == 'WorldSnap' else 1
+    curves = count * (9 + switched)
+    assert cmds.count('setKeyframe') == curves
+    assert sum(1 for call, args, kwargs in cmds.calls if call == 'setAttr' and '.ktv[' in args[0]) == curves
+    assert cmds.count('addAttr') <= 2 * len(nodes)
+
+
+@pytest.mark.parametrize('count', SIZES)
+def test_object_snap_budget(cmds, count):
+    frames = 6 * count
+    cmds.add_node('target')
+    cmds.key('target', 'translateX', {1: 0.0, frames: 9.0})
+    cmds.add_node('group', translateX=2.0)
+    cmds.add_node('child', parent='group')
+    cmds.selection = ['target', 'child']
+    cmds.time_range = (1.0, float(frames))
+    cmds.reset_calls()
+
+    ESwitcher.ObjSnap()
+
+    assert evaluations(cmds) == frames + 1
+    assert cmds.count('setKeyframe') == 3
+    assert cmds.count('pointConstraint') == cmds.count('spaceLocator') == 0
+    assert cmds.value('group', 'translateX', float(frames)) == pytest.approx(11.0)
+
+
+@pytest.mark.parametrize('with_joint', (True, False))
+def test_joint_search_visits_each_node_once(cmds, with_joint):
+    cmds.option_vars.update({'ESwitch_Elbow': 'Elbow', 'ESwitch_Knee': 'Knee'})
+    hub = ['rig_node{}_l'.format(index) for index in range(12)]
+    for name in hub:
+        cmds.add_node(name).connections = [other for other in hub if other != name]
+    if with_joint:
+        cmds.add_node('leg_Knee_jnt_l')
+        cmds.nodes[hub[-1]].connections.append('leg_Knee_jnt_l')
+    cmds.add_node('knee_ctrl_l').connections = [hub[0]]
+
+    joint = ESwitcher.Lock.identify_joint('knee_ctrl_l')
+
+    assert joint == ('leg_Knee_jnt_l' if with_joint else None)
+    assert cmds.count('listConnections') <= len(cmds.nodes)
+
+
+def test_repeated_switch_reuses_the_compiled_plan(cmds):
+    controls = build_switch_rig(cmds, count=8)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+    ESwitcher.Switch('Follow')
+    cmds.reset_calls()
+
+    ESwitcher.Switch('Follow')
+
+    assert cmds.count('listAttr') == 0
+
+
+def test_cached_plan_rechecks_batch_eligibility(cmds):
+    controls = build_switch_rig(cmds, count=2)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+    ESwitcher.Switch('Follow')
+    cmds.nodes[controls[1]].pivots['rotatePivot'] = (0.0, 1.0, 0.0)
+    cmds.reset_calls()
+
+    ESwitcher.Switch('Follow')
+
+    # The plan is reused, but the control that gained a pivot leaves the batched path.
+    assert cmds.count('listAttr') == 0
+    assert [args[0] for call, args, kwargs in cmds.calls if call == 'matchTransform'][1::2] == [controls[1]] * 3
+
+
+def enable_cached_playback(cmds, monkeypatch):
+    monkeypatch.setattr(cmds, 'evaluator', lambda *args, **kwargs: True, raising=False)
+    monkeypatch.setattr(cmds, 'cacheEvaluator', lambda *args, **kwargs: (
+        list(cmds.nodes) if kwargs.get('listCachedNodes') else False), raising=False)
+
+
+def test_cached_playback_misses_fall_back_to_moving_the_time(cmds, monkeypatch):
+    count = 8
+    frames = tuple(range(1, 11))
+    run_attribute_switch(cmds, count, frames)
+    default = evaluations(cmds)
+
+    fake = type(cmds)()
+    monkeypatch.setattr(ESwitcher, 'cmds', fake)
+    ESwitcher.lifecycle.clear_caches()
+    enable_cached_playback(fake, monkeypatch)
+    controls = build_switch_rig(fake, count=count, frames=frames)
+    held = dict(((c, f), fake.world_matrix(c, float(f))) for c in controls for f in frames)
+    fake.selection = controls
+    fake.time_range = (1.0, 10.0)
+    fake.reset_calls()
+
+    switch = ESwitcher.AttributeSwitch('Follow')
+
+    # The switch keys invalidate the cache, so every frame misses from there on.
+    assert sum(1 for call, args, kwargs in fake.calls if call == 'getAttr' and 'time' in kwargs) == 0
+    assert evaluations(fake) <= default
+    assert all(not result['frames'] for result in switch.drift.values())
+    for (control, frame), matrix in held.items():
+        assert max(abs(a - b) for a, b in zip(fake.world_matrix(control, float(frame)), matrix)) < 1e-6
+
+
+def test_cache_hits_stop_once_keys_are_written(cmds, monkeypatch, capsys):
+    enable_cached_playback(cmds, monkeypatch)
+    controls = build_switch_rig(cmds, count=2)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+
+    ESwitcher.WorldSnap()
+
+    # The bake pass is served by the cache, the verification pass after the keys are written is not.
+    assert "50% of sampled frames read from the cache (10 hits, 10 misses)" in capsys.readouterr().out
@@ -0,0 +1,436 @@
+import pytest
+
+import ESwitcher
+from conftest import assert_matrix_close, build_lock_rig, build_switch_rig, compose
+
+
+def test_attribute_switch_keeps_world_pose(cmds):
+    controls = build_switch_rig(cmds, count=3)
+    before = dict(((c, f), cmds.world_matrix(c, f)) for c in controls for f in (1.0, 5.0, 10.0))
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+
+    ESwitcher.AttributeSwitch('Follow')
+
+    for (control, frame), matrix in before.items():
+        assert cmds.value(control, 'Follow', frame) == 1.0
+        assert_matrix_close(cmds.world_matrix(control, frame), matrix)
+    assert cmds.count('spaceLocator') == 0
+
+
+def test_attribute_switch_matches_the_attribute_case_insensitively(cmds):
+    controls = build_switch_rig(cmds, count=2)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+
+    switch = ESwitcher.AttributeSwitch('follow')
+
+    assert isinstance(switch, ESwitcher.Switch)
+    for control in controls:
+        assert [cmds.value(control, 'Follow', f) for f in (1.0, 5.0, 10.0)] == [1.0, 1.0, 1.0]
+    assert all(not result['frames'] for result in switch.drift.values())
+
+def test_world_snap_holds_current_pose(cmds, math_backend):
+    controls = build_switch_rig(cmds, count=2)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+    cmds.time = 4.0
+    held = dict((c, cmds.world_matrix(c, 4.0)) for c in controls)
+
+    ESwitcher.WorldSnap()
+
+    for control in controls:
+        for frame in range(1, 11):
+            assert_matrix_close(cmds.world_matrix(control, float(frame)), held[control])
+    assert cmds.time == 4.0
+
+
+def test_switch_reports_no_drift(cmds, math_backend):
+    controls = build_switch_rig(cmds, count=2)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+
+    switch = ESwitcher.AttributeSwitch('Follow')
+
+    assert set(switch.drift) == set(controls)
+    for result in switch.drift.values():
+        assert result['frames'] == []
+        assert result['max_position'] < 1e-6
+
+
+def test_world_snap_holds_a_selected_parent_and_child(cmds, math_backend):
+    cmds.add_node('parent_ctrl', translateY=2.0)
+    cmds.key('parent_ctrl', 'translateX', {1: 0.0, 10: 10.0})
+    cmds.key('parent_ctrl', 'rotateY', {1: 0.0, 10: 90.0})
+    cmds.add_node('child_ctrl', parent='parent_ctrl', translateX=5.0)
+    cmds.key('child_ctrl', 'rotateZ', {1: 0.0, 10: 45.0})
+    cmds.selection = ['child_ctrl', 'parent_ctrl']
+    cmds.time_range = (1.0, 10.0)
+    held = dict((c, cmds.world_matrix(c, 1.0)) for c in cmds.selection)
+
+    snap = ESwitcher.WorldSnap()
+
+    for control, matrix in held.items():
+        for frame in range(1, 11):
+            assert_matrix_close(cmds.world_matrix(control, float(frame)), matrix)
+    assert all(not result['frames'] for result in snap.drift.values())
+
+def test_drift_report_lists_offending_frames(cmds, math_backend):
+    controls = build_switch_rig(cmds, count=1)
+    bake = ESwitcher.TransformBake()
+    bake.add(controls[0], dict((f, cmds.world_matrix(controls[0], f)) for f in (1.0, 5.0, 10.0)))
+    cmds.key(controls[0], 'translateY', {1.0: 0.0, 5.0: 2.0, 10.0: 0.0})
+
+    report = ESwitcher.verify_bake(bake)
+
+    assert report[controls[0]]['frames'] == [5.0]
+    assert abs(report[controls[0]]['max_position'] - 2.0) < 1e-6
+
+
+def test_frame_ranges_merge_into_one_sorted_set(cmds):
+    ranges = ESwitcher.resolve_frame_ranges(ranges=[(8, 12), (1, 3), (10, 15)], frames=[20, 2])
+
+    assert ranges == [(1.0, 3.0), (8.0, 15.0), (20.0, 20.0)]
+    assert ESwitcher.frames_in_ranges(ranges) == [1.0, 2.0, 3.0] + [float(f) for f in range(8, 16)] + [20.0]
+
+
+def test_world_snap_on_disjoint_ranges_samples_once_per_frame(cmds):
+    controls = build_switch_rig(cmds, count=3)
+    cmds.selection = controls
+    cmds.time = 1.0
+    held = dict((c, cmds.world_matrix(c, 1.0)) for c in controls)
+    cmds.optionVar(iv=('ESwitch_Verify', 0))
+
+    ESwitcher.WorldSnap(ranges=[(1, 3), (8, 10)], frames=[5])
+
+    for control in controls:
+        for frame in (1.0, 2.0, 3.0, 5.0, 8.0, 9.0, 10.0):
+            assert_matrix_close(cmds.world_matrix(control, frame), held[control])
+        assert 4.0 not in cmds.nodes[control].curves['rotateX']
+    assert cmds.count('currentTime', update=True) == 7 + 1
+
+
+def test_object_snap_follows_target_with_offset(cmds):
+    cmds.add_node('target')
+    cmds.key('target', 'translateX', {1: 0.0, 10: 9.0})
+    cmds.add_node('grand', translateY=1.0, rotateZ=30.0)
+    cmds.add_node('group', parent='grand', translateX=2.0)
+    cmds.add_node('child', parent='group')
+    cmds.selection = ['target', 'child']
+    cmds.time_range = (1.0, 10.0)
+    offset = [a - b for a, b in zip(cmds.world_matrix('group', 1.0)[12:15], cmds.world_matrix('target', 1.0)[12:15])]
+
+    ESwitcher.ObjSnap()
+
+    for frame in range(1, 11):
+        expected = [a + b for a, b in zip(cmds.world_matrix('target', float(frame))[12:15], offset)]
+        assert_matrix_close(cmds.world_matrix('group', float(frame))[12:15], expected)
+    assert cmds.count('pointConstraint') == 0
+
+
+def test_object_snap_keeps_the_constraint_for_a_target_with_a_moved_pivot(cmds):
+    cmds.add_node('target', rotateY=45.0).pivots['rotatePivot'] = (1.0, 0.0, 0.0)
+    cmds.add_node('group')
+    cmds.add_node('child', parent='group')
+    cmds.selection = ['target', 'child']
+    cmds.time_range = (1.0, 3.0)
+
+    ESwitcher.ObjSnap()
+
+    assert cmds.count('pointConstraint') == 2
+    assert cmds.count('setKeyframe') == 3
+
+def test_euler_filter_removes_flips(math_backend):
+    rotates = [[10.0, 20.0, 170.0], [190.0, 160.0, -5.0], [15.0, 25.0, -170.0], [-165.0, 150.0, 20.0]]
+
+    filtered = ESwitcher.filter_euler(rotates, 0, seed=[370.0, 20.0, 170.0])
+
+    assert [round(v, 6) for v in filtered[0]] == [370.0, 20.0, 170.0]
+    for previous, current in zip(filtered, filtered[1:]):
+        assert max(abs(a - b) for a, b in zip(previous, current)) < 30.0
+    for original, result in zip(rotates, filtered):
+        assert_matrix_close(ESwitcher.decompose_matrix(compose([0, 0, 0], result))[1],
+                            ESwitcher.decompose_matrix(compose([0, 0, 0], original))[1])
+
+
+class FakeWindow(object):
+    def __init__(self):
+        self.closed = False
+        self.deleted = False
+
+    def close(self):
+        self.closed = True
+
+    def deleteLater(self):
+        self.deleted = True
+
+
+def test_lifecycle_releases_windows_and_caches(cmds, monkeypatch):
+    lifecycle = ESwitcher.Lifecycle()
+    popup = FakeWindow()
+    monkeypatch.setitem(ESwitcher.windows, 'left', popup)
+    cache = lifecycle.register_cache('records', {'arm_ctrl_l': list(range(100))})
+
+    assert lifecycle.diagnostics()['windows'] == ['left']
+    assert lifecycle.diagnostics()['caches']['records'] > 0
+
+    lifecycle.release()
+
+    assert popup.closed and popup.deleted
+    assert cache == {}
+    assert lifecycle.diagnostics()['windows'] == []
+    assert not lifecycle.is_live(popup)
+
+
+def test_registering_a_cache_installs_the_scene_jobs_once(cmds):
+    lifecycle = ESwitcher.Lifecycle()
+
+    lifecycle.register_cache('history', {})
+    lifecycle.register_cache('plans', {})
+
+    events = [kwargs['event'][0] for call, args, kwargs in cmds.calls if call == 'scriptJob']
+    assert events == list(ESwitcher.Lifecycle.scene_events)
+
+def test_mirrored_switch_shares_one_sampling_pass(cmds):
+    controls = build_switch_rig(cmds, count=2)
+    left = controls[0]
+    right = left[:-1] + 'r'
+    cmds.nodes[right] = cmds.nodes.pop(controls[1])
+    cmds.nodes[right].name = right
+    cmds.nodes[right].space = lambda fake, frame: 'spaceB' if fake.value(right, 'Follow', frame) >= 0.5 else 'spaceA'
+    cmds.selection = [left]
+    cmds.time_range = (1.0, 10.0)
+    cmds.optionVar(iv=('ESwitch_Verify', 0))
+    ESwitcher.mirror_index.clear()
+
+    ESwitcher.AttributeSwitch('Follow', mirror=True)
+
+    for control in (left, right):
+        assert [cmds.value(control, 'Follow', f) for f in (1.0, 5.0, 10.0)] == [1.0, 1.0, 1.0]
+    assert cmds.count('currentTime', update=True) == 2 * 3 + 1
+
+
+def test_mirrored_lock_matches_the_attribute_case_insensitively(cmds):
+    controllers = build_lock_rig(cmds, count=2, mirrored=True)
+    cmds.selection = [controllers[0][0]]
+    cmds.time_range = (1.0, 10.0)
+    joints = dict(((joint, f), cmds.world_matrix(joint, f)) for _, joint in controllers for f in (1.0, 5.0, 10.0))
+
+    ESwitcher.Lock('lock', mirror=True)
+
+    for name, joint in controllers:
+        for frame in (1.0, 5.0, 10.0):
+            assert cmds.value(name, 'Lock', frame) == 1.0
+            assert_matrix_close(cmds.world_matrix(name, frame), joints[(joint, frame)])
+
+def test_reapply_rewrites_only_changed_spans(cmds):
+    controls = build_switch_rig(cmds, count=1, frames=tuple(range(1, 61)))
+    control = controls[0]
+    cmds.add_node('offset')
+    cmds.nodes['offset'].inputs = ['spaceA', 'spaceB', control]
+    cmds.nodes[control].parent = 'offset'
+    cmds.key('spaceA', 'rotateY', {1: 0.0, 30: 45.0, 60: 90.0})
+    cmds.selection = [control]
+    cmds.time_range = (1.0, 60.0)
+    cmds.optionVar(iv=('ESwitch_Verify', 0))
+    ESwitcher.AttributeSwitch('Follow')
+    held = dict((f, cmds.world_matrix(control, float(f))) for f in range(1, 61))
+
+    cmds.key('spaceA', 'rotateY', {55: 10.0})
+    cmds.reset_calls()
+    rewritten = ESwitcher.reapply([control])
+
+    assert sorted(rewritten[control]) == [float(f) for f in range(25, 61)]
+    assert cmds.count('setKeyframe') == 9
+    for frame, matrix in held.items():
+        assert_matrix_close(cmds.world_matrix(control, float(frame)), matrix)
+
+    cmds.reset_calls()
+    assert ESwitcher.reapply([control]) == {}
+    assert cmds.count('setKeyframe') == 0
+
+
+def test_reapply_follows_edits_on_dag_ancestors(cmds):
+    cmds.add_node('root')
+    cmds.key('root', 'rotateY', {1: 0.0, 10: 90.0})
+    cmds.add_node('cog', parent='root', translateY=5.0)
+    cmds.add_node('group', parent='cog', translateX=2.0)
+    cmds.add_node('hand_ctrl_l', parent='group')
+    cmds.selection = ['hand_ctrl_l']
+    cmds.time_range = (1.0, 10.0)
+    held = dict((f, cmds.world_matrix('hand_ctrl_l', float(f))) for f in range(1, 11))
+    ESwitcher.WorldSnap()
+
+    cmds.key('root', 'rotateY', {10: 45.0})
+    rewritten = ESwitcher.reapply(['hand_ctrl_l'])
+
+    assert sorted(rewritten['hand_ctrl_l']) == [float(f) for f in range(1, 11)]
+    assert_matrix_close(cmds.world_matrix('hand_ctrl_l', 10.0), held[1])
+
+
+def test_reapply_follows_edits_on_space_target_parents(cmds):
+    controls = build_switch_rig(cmds, count=1)
+    control = controls[0]
+    cmds.add_node('world_root')
+    cmds.key('world_root', 'translateX', {1: 0.0, 10: 3.0})
+    cmds.nodes['spaceB'].parent = 'world_root'
+    cmds.add_node('offset')
+    cmds.nodes['offset'].inputs = ['spaceA', 'spaceB']
+    cmds.nodes[control].parent = 'offset'
+    cmds.selection = [control]
+    cmds.time_range = (1.0, 10.0)
+    ESwitcher.AttributeSwitch('Follow')
+    held = dict((f, cmds.world_matrix(control, f)) for f in (1.0, 5.0, 10.0))
+
+    cmds.key('world_root', 'translateX', {10: 8.0})
+    rewritten = ESwitcher.reapply([control])
+
+    assert sorted(rewritten[control]) == [1.0, 5.0, 10.0]
+    for frame, matrix in held.items():
+        assert_matrix_close(cmds.world_matrix(control, frame), matrix)
+
+def test_enum_switch_cycles_through_values_with_a_cached_plan(cmds, monkeypatch):
+    controls = build_switch_rig(cmds, count=2, attr='space')
+    for control in controls:
+        cmds.nodes[control].enums['space'] = 'world:chest=2:hand'
+        cmds.nodes[control].space = lambda fake, frame, name=control: ['spaceA', None, 'spaceB', 'spaceA'][int(fake.value(name, 'space', frame))]
+    monkeypatch.setitem(ESwitcher.RIG_TYPES, 'biped', {'Follow': {'attribute': 'space', 'values': 'enum'}})
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+    held = dict(((c, f), cmds.world_matrix(c, f)) for c in controls for f in (1.0, 5.0, 10.0))
+
+    ESwitcher.Switch('Follow', rig_type='biped')
+    assert [cmds.value(controls[0], 'space', f) for f in (1.0, 5.0, 10.0)] == [2.0, 2.0, 2.0]
+
+    cmds.reset_calls()
+    switch = ESwitcher.Switch('Follow', rig_type='biped')
+    assert [cmds.value(controls[0], 'space', f) for f in (1.0, 5.0, 10.0)] == [3.0, 3.0, 3.0]
+    assert cmds.count('listAttr') == 0
+
+    for (control, frame), matrix in held.items():
+        assert_matrix_close(cmds.world_matrix(control, frame), matrix)
+    assert all(not result['frames'] for result in switch.drift.values())
+
+
+def test_ik_fk_switch_matches_controls_driven_by_a_settings_node(cmds, monkeypatch):
+    cmds.add_node('arm_settings_l').values['ikFk'] = 0.0
+    cmds.key('arm_settings_l', 'ikFk', {1: 0.0, 5: 0.0})
+    cmds.add_node('arm_wrist_jnt_l', translateX=5.0)
+    cmds.key('arm_wrist_jnt_l', 'rotateX', {1: 0.0, 5: 40.0})
+    cmds.add_node('chest', translateY=2.0)
+    cmds.key('chest', 'rotateZ', {1: 0.0, 5: 25.0})
+    cmds.add_node('arm_ik_ctrl_l')
+    cmds.nodes['arm_ik_ctrl_l'].space = lambda fake, frame: 'chest' if fake.value('arm_settings_l', 'ikFk', frame) >= 0.5 else None
+    monkeypatch.setitem(ESwitcher.RIG_TYPES, 'biped', {
+        'IKFK': {'attribute': 'ikFk', 'values': (0, 1), 'strategy': 'targets',
+                 'targets': [('arm_ik_ctrl_{side}', 'arm_wrist_jnt_{side}')]}})
+    cmds.selection = ['arm_settings_l']
+    cmds.time_range = (1.0, 5.0)
+    wrist = dict((f, cmds.world_matrix('arm_wrist_jnt_l', f)) for f in (1.0, 5.0))
+
+    switch = ESwitcher.Switch('IKFK', rig_type='biped')
+
+    assert switch.drift['arm_ik_ctrl_l']['frames'] == []
+    for frame, matrix in wrist.items():
+        assert cmds.value('arm_settings_l', 'ikFk', frame) == 1.0
+        assert_matrix_close(cmds.world_matrix('arm_ik_ctrl_l', frame), matrix)
+
+
+def test_lock_matches_controllers_onto_their_joints(cmds, math_backend):
+    controllers = build_lock_rig(cmds, count=2)
+    cmds.selection = [name for name, _ in controllers]
+    cmds.time_range = (1.0, 10.0)
+    joints = dict(((joint, f), cmds.world_matrix(joint, f)) for _, joint in controllers for f in (1.0, 5.0, 10.0))
+
+    lock = ESwitcher.Lock('lock')
+
+    assert set(lock.drift) == set(name for name, _ in controllers)
+    assert all(result['frames'] == [] for result in lock.drift.values())
+    assert cmds.count('inViewMessage') == len(controllers)
+
+    for name, joint in controllers:
+        for frame in (1.0, 5.0, 10.0):
+            assert cmds.value(name, 'Lock', frame) == 1.0
+            assert_matrix_close(cmds.world_matrix(name, frame), joints[(joint, frame)])
+
+
+def test_benchmark_solve_times_both_paths_without_keying(cmds, math_backend):
+    controls = build_switch_rig(cmds, count=3)
+    cmds.selection = controls
+    cmds.time = 4.0
+
+    timings = ESwitcher.benchmark_solve()
+
+    assert sorted(timings) == ['batched', 'per_frame']
+    assert cmds.count('setKeyframe') == 0
+    assert cmds.time == 4.0
+
+
+def test_batched_solve_matches_the_per_frame_solve(cmds, math_backend):
+    controls = build_switch_rig(cmds, count=6)
+    bake = ESwitcher.TransformBake()
+    for control in controls:
+        bake.add(control, dict((float(f), cmds.world_matrix(control, float(f) + 0.5)) for f in range(1, 11)))
+    bake.prepare()
+    samples = bake.sample(bake.frames())
+
+    solved = ESwitcher.solve_transforms(samples)
+
+    assert [entry[0] for entry in solved] == controls
+    for node, rotate_order, frames, targets, parent_inverses in samples:
+        _, _, translates, rotates, scales = solved[controls.index(node)]
+        for n, (target, parent_inverse) in enumerate(zip(targets, parent_inverses)):
+            expected = ESwitcher.decompose_matrix(ESwitcher.multiply_matrix(target, parent_inverse), rotate_order)
+            assert_matrix_close(translates[n] + rotates[n] + scales[n], expected[0] + expected[1] + expected[2])
+
+
+def test_lock_plan_follows_renamed_joints(cmds):
+    controllers = build_lock_rig(cmds, count=1)
+    cmds.option_vars['ESwitch_Knee'] = 'Ankle'
+    cmds.selection = [controllers[0][0]]
+    cmds.time_range = (1.0, 10.0)
+
+    assert ESwitcher.Switch('Lock').plan.entries == []
+
+    cmds.optionVar(sv=('ESwitch_Knee', 'Knee'))
+    switch = ESwitcher.Switch('Lock')
+
+    assert [pairs for _, _, pairs in switch.plan.entries] == [[controllers[0]]]
+    assert cmds.value(controllers[0][0], 'Lock', 5.0) == 1.0
+
+
+def test_switch_to_a_named_enum_value_in_one_bake(cmds, monkeypatch):
+    controls = build_switch_rig(cmds, count=2, attr='space')
+    for control in controls:
+        cmds.nodes[control].enums['space'] = 'world:chest=2:hand'
+        cmds.nodes[control].space = lambda fake, frame, name=control: ['spaceA', None, 'spaceB', 'spaceA'][int(fake.value(name, 'space', frame))]
+    monkeypatch.setitem(ESwitcher.RIG_TYPES, 'biped', {'Follow': {'attribute': 'space', 'values': 'enum'}})
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+    held = dict(((c, f), cmds.world_matrix(c, f)) for c in controls for f in (1.0, 5.0, 10.0))
+
+    ESwitcher.Switch('Follow', rig_type='biped', value='Hand')
+    assert [cmds.value(controls[0], 'space', f) for f in (1.0, 5.0, 10.0)] == [3.0, 3.0, 3.0]
+
+    ESwitcher.Switch('Follow', rig_type='biped', value=0)
+    assert [cmds.value(controls[1], 'space', f) for f in (1.0, 5.0, 10.0)] == [0.0, 0.0, 0.0]
+    for (control, frame), matrix in held.items():
+        assert_matrix_close(cmds.world_matrix(control, frame), matrix)
+
+    cmds.reset_calls()
+    ESwitcher.Switch('Follow', rig_type='biped', value='pelvis')
+    assert cmds.count('setKeyframe') == 0
+    assert cmds.count('inViewMessage') == len(controls)
+
+
+def test_switch_kind_missing_from_the_rig_type_shows_a_message(cmds):
+    controls = build_switch_rig(cmds, count=1)
+    cmds.selection = controls
+    cmds.time_range = (1.0, 10.0)
+
+    switch = ESwitcher.Switch('IKFK')
+
+    assert switch.drift is None
+    assert cmds.count('setKeyframe') == 0
+    assert [kwargs['amg'] for call, args, kwargs in cmds.calls if call == 'inViewMessage'] == [
+        "No 'IKFK' switch declared for the 'default' rig type."]